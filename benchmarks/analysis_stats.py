@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Times analysis._data_slice and analysis._summary_stats on arrays against the
+list implementations they replaced and checks that both give the same
+results.
+
+Usage: python benchmarks/analysis_stats.py [samples]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dstat_interface_mrbox'))
+
+import analysis
+
+
+def data_slice_loop(data, start, stop):
+    '''
+    List implementation of `analysis._data_slice` used before data was
+    stored in arrays, with its range check corrected to keep only samples
+    between start and stop.
+    '''
+    output = []
+
+    for scan in range(len(data)):
+        t = []
+        for i in range(len(data[scan])):
+            t.append([])
+        output.append(tuple(t))
+
+        for i in range(len(data[scan][0])): # x-axis column
+            if data[scan][0][i] >= start and data[scan][0][i] <= stop:
+                for d in range(len(output[scan])):
+                    output[scan][d].append(data[scan][d][i])
+
+    return output
+
+
+def summary_stats_loop(data):
+    '''
+    List implementation of `analysis._summary_stats` used before data was
+    stored in arrays. Only computes min, max and mean.
+    '''
+    stats = {'min':[],'max':[], 'mean':[]}
+
+    for scan in range(len(data)):
+        stats['min'].append(
+                            (scan, min(data[scan][1]))
+                            )
+        stats['max'].append(
+                            (scan, max(data[scan][1]))
+                            )
+        stats['mean'].append(
+                            (scan, np.mean(data[scan][1]))
+                            )
+    return stats
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def main(samples=10 ** 7, seed=0):
+    x = np.arange(samples) / 100.
+    y = np.random.RandomState(seed).randn(samples)
+    arrays = [(x, y)]
+    lists = [(x.tolist(), y.tolist())]
+    start, stop = x[samples // 10], x[samples // 2]
+
+    timings = []
+    loop_time, loop_slice = timed(data_slice_loop, lists, start, stop)
+    array_time, array_slice = timed(analysis._data_slice, arrays, start, stop)
+    timings.append(('_data_slice', loop_time, array_time))
+
+    loop_time, loop_stats = timed(summary_stats_loop, loop_slice)
+    array_time, array_stats = timed(analysis._summary_stats, array_slice)
+    timings.append(('_summary_stats', loop_time, array_time))
+
+    print "%s samples, %s in slice" % (samples, len(array_slice[0][0]))
+    print "  %-16s %10s %10s" % ('', 'lists', 'arrays')
+    for name, loop_time, array_time in timings:
+        print "  %-16s %8.2f s %8.2f s" % (name, loop_time, array_time)
+
+    for expected, result in zip(loop_slice, array_slice):
+        for expected_column, column in zip(expected, result):
+            assert np.array_equal(expected_column, column)
+    for key in loop_stats:
+        assert np.allclose([value for scan, value in loop_stats[key]],
+                           [value for scan, value in array_stats[key]]), key
+    print "Results match."
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
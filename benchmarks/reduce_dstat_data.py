@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Times analysis.reduce_dstat_data against the per-group loop it replaced and
+checks that both give the same table.
+
+Usage: python benchmarks/reduce_dstat_data.py [groups]
+"""
+import os
+import sys
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dstat_interface_mrbox'))
+
+import analysis
+
+
+def reduce_loop(df_dstat, groupby, settling_period_s=2., bandwidth=1.,
+                summary_fields=[]):
+    '''
+    Per-group implementation of `analysis.reduce_dstat_data` used before it
+    was vectorized.
+    '''
+    rows = []
+
+    for index_i, df_i in df_dstat.groupby(groupby):
+        summary_i = df_i.iloc[0][summary_fields].copy()
+        summary_i.name = index_i
+
+        if 'target_hz' in summary_i and summary_i['target_hz'] > 0:
+            df_fft_i = analysis.dstat_to_fft_frame(
+                df_i, sample_frequency_hz=summary_i['sample_frequency_hz'],
+                settling_period_s=settling_period_s)
+            summary_i['signal'] = analysis.integrate_fft(
+                df_fft_i, summary_i['target_hz'], bandwidth)
+        else:
+            summary_i['signal'] = (df_i.loc[df_i.time_s > settling_period_s]
+                                   .current_amps.mean())
+        if isinstance(index_i, types.StringTypes):
+            index_i = [index_i]
+        else:
+            index_i = list(index_i)
+        rows.append(index_i + summary_i.tolist())
+
+    return pd.DataFrame(rows, columns=groupby + summary_i.keys().tolist())
+
+
+def measurements(groups, samples=50, sync_groups=20, seed=0):
+    '''
+    Returns table of `groups` continuous detection experiments of `samples`
+    samples at 10 Hz and `sync_groups` synchronous detection experiments of
+    10 s at 60 Hz with a 5 Hz signal.
+    '''
+    rng = np.random.RandomState(seed)
+    index = np.arange(groups)
+    frames = [pd.DataFrame({'step': np.repeat(index // 100, samples),
+                            'rep': np.repeat(index % 100, samples),
+                            'time_s': np.tile(np.arange(samples) * .1, groups),
+                            'current_amps': rng.randn(groups * samples),
+                            'sample_frequency_hz': 10., 'target_hz': 0.,
+                            'label': np.repeat(['c%d' % i for i in index],
+                                               samples)})]
+    time_s = np.arange(600) / 60.
+    for i in range(sync_groups):
+        frames.append(pd.DataFrame({
+            'step': groups // 100 + 1 + i, 'rep': 0, 'time_s': time_s,
+            'current_amps': (np.sin(2 * np.pi * 5 * time_s) +
+                             .1 * rng.randn(len(time_s))),
+            'sample_frequency_hz': 60., 'target_hz': 5., 'label': 's%d' % i}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(groups=10 ** 4):
+    df_dstat = measurements(groups)
+    groupby = ['step', 'rep']
+    summary_fields = ['label', 'sample_frequency_hz', 'target_hz']
+
+    timings = []
+    tables = []
+    for name, reduce in [
+            ('loop', lambda: reduce_loop(df_dstat, groupby,
+                                         summary_fields=summary_fields)),
+            ('vectorized, 1 process', lambda: analysis.reduce_dstat_data(
+                df_dstat, groupby, summary_fields=summary_fields,
+                processes=1)),
+            ('vectorized, pool', lambda: analysis.reduce_dstat_data(
+                df_dstat, groupby, summary_fields=summary_fields))]:
+        start = time.time()
+        tables.append(reduce())
+        timings.append((name, time.time() - start))
+
+    print "%s groups, %s rows" % (groups + 20, len(df_dstat))
+    for name, seconds in timings:
+        print "  %-24s %.2f s" % (name, seconds)
+
+    expected = tables[0]
+    for table in tables[1:]:
+        assert list(table.columns) == list(expected.columns)
+        for column in expected:
+            if expected[column].dtype == object:
+                assert (table[column].values == expected[column].values).all()
+            else:
+                assert np.allclose(table[column].values.astype(float),
+                                   expected[column].values.astype(float),
+                                   equal_nan=True), column
+    print "Tables match."
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
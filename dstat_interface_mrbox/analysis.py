@@ -22,7 +22,10 @@ Functions for analyzing data.
 """
 import logging
 import datetime as dt
-import cStringIO as StringIO
+from collections import OrderedDict
+import glob
+import multiprocessing
+import os
 import re
 import types
 
@@ -32,6 +35,26 @@ import arrow
 
 logger = logging.getLogger('dstat.analysis')
 
+# Experiment type of the command letter that starts each experiment.
+EXPERIMENT_COMMANDS = {'R': 'CA', 'L': 'LSV', 'C': 'CV', 'S': 'SWV',
+                       'D': 'DPV', 'P': 'POT'}
+# Commands only sent for photodiode experiments (shutter control).
+PD_COMMANDS = set(['Z', 'z', '1', '2'])
+# Columns of each scan in text files written by `interface.save.save_text`.
+TEXT_COLUMNS = {'CA': ['time_s', 'current_amps'],
+                'PD': ['time_s', 'current_amps'],
+                'POT': ['time_s', 'voltage_volts'],
+                'LSV': ['voltage_volts', 'current_amps'],
+                'CV': ['voltage_volts', 'current_amps'],
+                'SWV': ['voltage_volts', 'current_amps',
+                        'forward_current_amps', 'reverse_current_amps'],
+                'DPV': ['voltage_volts', 'current_amps',
+                        'forward_current_amps', 'reverse_current_amps']}
+# Order of analysis results. The first four are in the order the text
+# output of earlier versions listed them, statistics added since follow.
+ANALYSIS_ORDER = ('max', 'min', 'FT Integral', 'mean', 'std', 'median',
+                  '5th percentile', '95th percentile')
+
 class AnalysisOptions(object):
     """Analysis options window."""
     def __init__(self, builder):
@@ -102,7 +125,7 @@ class AnalysisOptions(object):
 def do_analysis(experiment):
     """Takes an experiment class instance and runs selected analysis."""
 
-    experiment.analysis = {}
+    analysis = {}
 
     if experiment.parameters['stats_true']:
         if (experiment.parameters['stats_start_true'] or
@@ -111,12 +134,12 @@ def do_analysis(experiment):
             if experiment.parameters['stats_start_true']:
                 start = experiment.parameters['stats_start']
             else:
-                start = min(experiment.data['data'][0][0])
+                start = np.min(experiment.data['data'][0][0])
 
             if experiment.parameters['stats_stop_true']:
                 stop = experiment.parameters['stats_stop']
             else:
-                stop = min(experiment.data['data'][0][0])
+                stop = np.max(experiment.data['data'][0][0])
 
             data = _data_slice(experiment.data['data'],
                                start,
@@ -125,11 +148,11 @@ def do_analysis(experiment):
         else:
             data = experiment.data['data']
 
-        experiment.analysis.update(_summary_stats(data))
+        analysis.update(_summary_stats(data))
 
     try:
         x, y = experiment.data['ft'][0]
-        experiment.analysis['FT Integral'] = _integrateSpectrum(
+        analysis['FT Integral'] = _integrateSpectrum(
                 x,
                 y,
                 float(experiment.parameters['sync_freq']),
@@ -139,42 +162,127 @@ def do_analysis(experiment):
     except KeyError:
         pass
 
+    experiment.analysis = OrderedDict((key, analysis[key])
+                                      for key in ANALYSIS_ORDER
+                                      if key in analysis)
+
+class WelchEstimator(object):
+    '''
+    Incremental Welch power spectrum estimate.  Hann-windowed segments
+    overlapping by half are added as samples arrive, so the spectrum can be
+    updated while an experiment is running.
+
+    Args
+    ----
+
+        sample_rate (float) : Sample rate in Hz.
+        segment (int) : Samples per segment.
+    '''
+    def __init__(self, sample_rate, segment):
+        self.sample_rate = float(sample_rate)
+        self.segment = int(segment)
+        self.step = self.segment // 2
+        self.window = np.hanning(self.segment)
+        self.power = np.zeros(self.segment // 2 + 1)
+        self.segments = 0
+        self.next = 0  # Start of next segment
+
+    def update(self, y):
+        '''
+        Add segments completed by new samples.
+
+        Args
+        ----
+
+            y (numpy.ndarray) : All samples so far (earlier samples must not
+                change).
+
+        Returns
+        -------
+
+            (int) : Number of segments added.
+        '''
+        y = np.asarray(y, dtype=float)
+        count = max((len(y) - self.next - self.segment) // self.step + 1, 0)
+        if not count:
+            return 0
+
+        segments = np.lib.stride_tricks.as_strided(
+            y[self.next:],
+            shape=(count, self.segment),
+            strides=(self.step * y.strides[0], y.strides[0]))
+        segments = segments - segments.mean(axis=1)[:, np.newaxis]
+        spectra = np.fft.rfft(segments * self.window, axis=1)
+        self.power += (np.abs(spectra) ** 2).sum(axis=0)
+        self.segments += count
+        self.next += count * self.step
+        return count
+
+    def spectrum(self):
+        '''
+        Returns
+        -------
+
+            (tuple) : Frequencies (Hz) and single-sided amplitude spectrum,
+                scaled like `plot.plotSpectrum`.
+        '''
+        frequency = np.fft.rfftfreq(self.segment, 1. / self.sample_rate)
+        if not self.segments:
+            return frequency, np.zeros(len(frequency))
+        amplitude = np.sqrt(self.power / self.segments) / self.window.sum()
+        return frequency, amplitude
+
+
+def welch_segment(sample_rate, bandwidth, resolution=4, minimum=64):
+    '''
+    Returns power-of-two segment length giving at least `resolution`
+    frequency bins across `bandwidth` Hz.  Returns `minimum` if
+    `bandwidth` or `sample_rate` isn't positive.
+    '''
+    if not (bandwidth > 0 and float(sample_rate) > 0):
+        logger.warning("Invalid Welch bandwidth %s Hz at %s Hz, using %s "
+                       "sample segments", bandwidth, sample_rate, minimum)
+        return minimum
+    length = resolution * float(sample_rate) / bandwidth
+    return max(int(2 ** np.ceil(np.log2(length))), minimum)
+
+
 def _data_slice(data, start, stop):
-    """Accepts data (as list of tuples of lists) and returns copy of data
-    between start and stop (in whatever x-axis units for the experiment type).
+    """Accepts data (as list of tuples of arrays) and returns copy of data
+    between start and stop inclusive (in whatever x-axis units for the
+    experiment type).
     """
     output = []
 
-    for scan in range(len(data)):
-        t = []
-        for i in range(len(data[scan])):
-            t.append([])
-        output.append(tuple(t))
-
-        for i in range(len(data[scan][0])): # x-axis column
-            if data[scan][0][i] >= start or data[scan][0][i] <= stop:
-                for d in range(len(output[scan])):
-                    output[scan][d].append(data[scan][d][i])
+    for scan in data:
+        x = np.asarray(scan[0]) # x-axis column
+        mask = (x >= start) & (x <= stop)
+        output.append(tuple(np.asarray(column)[mask] for column in scan))
 
     return output
 
 def _summary_stats(data):
     """Takes data and returns summary statistics of first y variable as dict of
-    name, (scan, values).
+    name, (scan, values). Empty scans are skipped.
     """
 
-    stats = {'min':[],'max':[], 'mean':[]}
+    stats = {'min':[], 'max':[], 'mean':[], 'std':[], 'median':[],
+             '5th percentile':[], '95th percentile':[]}
 
     for scan in range(len(data)):
-        stats['min'].append(
-                            (scan, min(data[scan][1]))
-                            )
-        stats['max'].append(
-                            (scan, max(data[scan][1]))
-                            )
-        stats['mean'].append(
-                            (scan, np.mean(data[scan][1]))
-                            )
+        y = np.asarray(data[scan][1])
+        if not len(y):
+            continue
+
+        p5, median, p95 = np.percentile(y, [5, 50, 95])
+        stats['min'].append((scan, float(y.min())))
+        stats['max'].append((scan, float(y.max())))
+        stats['mean'].append((scan, y.mean()))
+        stats['std'].append((scan, float(y.std())))
+        stats['median'].append((scan, float(median)))
+        stats['5th percentile'].append((scan, float(p5)))
+        stats['95th percentile'].append((scan, float(p95)))
+
     return stats
 
 def _integrateSpectrum(x, y, target, bandwidth):
@@ -244,34 +352,16 @@ def dstat_to_fft_frame(df_data, sample_frequency_hz=60., settling_period_s=2.):
         df_data (pandas.DataFrame) : DStat FFT table with the columns
             `frequency` and `amplitude`.
     '''
-    df_data_i = df_data.loc[(df_data.time_s > settling_period_s)].copy()
-    df_data_i.reset_index(drop=True, inplace=True)
-
-    avg = np.mean(df_data_i.current_amps.values)
-
-    # Find first and last rising edge in synchronous signal.
-    rising_edge_i = np.zeros(df_data_i.shape[0], dtype=bool)
-    rising_edge_i[:-1] = ((df_data_i.current_amps <= avg)[:-1].values &
-                          (df_data_i.current_amps > avg)[1:].values)
-    df_data_i['rising_edge'] = rising_edge_i
-    first_edge, last_edge = df_data_i.loc[df_data_i.rising_edge].index[[0, -1]]
-
-    # Set start and end of FFT measurements range to mean.
-    df_data_i.current_amps.values[[first_edge, last_edge]] = avg
-
-    # Restrict FFT to measurements between first and last rising edge.
-    df_edges_i = df_data_i.loc[first_edge:last_edge - 1, ['time_s',
-                                                          'current_amps']]
+    current = sync_trace(df_data, settling_period_s)
 
     # Length of the signal.
-    N = len(df_edges_i)
+    N = len(current)
 
     # Compute frequencies based on sampling frequency.
-    frequencies = np.fft.fftfreq(N, d=1. / sample_frequency_hz)[:N / 2]
+    frequencies = np.fft.fftfreq(N, d=1. / sample_frequency_hz)[:N // 2]
 
     # FFT computing and normalization.
-    Y = np.fft.fft(df_edges_i.current_amps.values) / N
-    Y = abs(Y[:N / 2])
+    Y = np.abs(np.fft.rfft(current)[:N // 2]) / N
 
     # Create data frame from frequency and amplitude arrays.
     df_fft_i = pd.DataFrame(np.column_stack([frequencies, Y]),
@@ -279,54 +369,302 @@ def dstat_to_fft_frame(df_data, sample_frequency_hz=60., settling_period_s=2.):
     return df_fft_i
 
 
+def sync_trace(df_data, settling_period_s=2.):
+    '''
+    Select current measurements of a synchronous detection experiment to
+    compute FFT from.
+
+    Args
+    ----
+
+        df_data (pandas.DataFrame) : DStat experiment results with at least the
+            columns `time_s`, and `current_amps`.
+        settling_period_s (float) : Signal settling time (in seconds).  No
+            measurements before specified time will be considered.
+
+    Returns
+    -------
+
+        (numpy.ndarray) : Current measurements after settling period, between
+            first and last rising edge of synchronous signal.  Measurements at
+            the edges are set to the mean.
+    '''
+    current = (df_data.current_amps.values
+               [df_data.time_s.values > settling_period_s].astype(float))
+
+    avg = np.mean(current)
+
+    # Find first and last rising edge in synchronous signal.
+    rising_edges = np.flatnonzero((current[:-1] <= avg) & (current[1:] > avg))
+    first_edge, last_edge = rising_edges[[0, -1]]
+
+    # Set start and end of FFT measurements range to mean.
+    current[[first_edge, last_edge]] = avg
+
+    # Restrict FFT to measurements between first and last rising edge.
+    return current[first_edge:last_edge]
+
+
+def _band_bins(N, sample_frequency_hz, target_hz, bandwidth):
+    '''
+    Indices and frequencies of FFT bins of an `N` sample signal within
+    bandwidth around target frequency (below the Nyquist frequency).
+    '''
+    # Bin spacing as computed by `numpy.fft.fftfreq`.
+    step = 1.0 / (N * (1. / sample_frequency_hz))
+    low = max(int(np.floor((target_hz - .5 * bandwidth) / step)), 0)
+    high = min(int(np.ceil((target_hz + .5 * bandwidth) / step)) + 1, N // 2)
+
+    bins = np.arange(low, max(high, low))
+    frequencies = bins * step
+    in_band = ((frequencies >= target_hz - .5 * bandwidth) &
+               (frequencies <= target_hz + .5 * bandwidth))
+    return bins[in_band], frequencies[in_band]
+
+
+def band_spectrum(current, sample_frequency_hz, target_hz, bandwidth):
+    '''
+    Compute FFT amplitudes only within bandwidth around a target frequency.
+
+    Args
+    ----
+
+        current (numpy.ndarray) : Measurements, e.g., from `sync_trace`.
+        sample_frequency_hz (float) : Sampling frequency.
+        target_hz (float) : Target frequency.
+        bandwidth (float) : Bandwidth (centered at target frequency).
+
+    Returns
+    -------
+
+        (tuple) : `frequencies` and `amplitudes` arrays of bins within
+            bandwidth, normalized as in `dstat_to_fft_frame`.
+    '''
+    current = np.asarray(current, dtype=float)
+    N = len(current)
+    bins, frequencies = _band_bins(N, sample_frequency_hz, target_hz,
+                                   bandwidth)
+    return frequencies, np.abs(np.fft.rfft(current)[bins]) / N
+
+
+def band_integral(current, sample_frequency_hz, target_hz, bandwidth):
+    '''
+    Integrate FFT amplitude within bandwidth around a target frequency.
+    Equivalent to `integrate_fft` applied to `dstat_to_fft_frame` results,
+    without building a table of the whole spectrum.
+
+    Returns
+    -------
+
+        (float) : Integrated amplitude (see `integrate_fft`).
+    '''
+    frequencies, amplitudes = band_spectrum(current, sample_frequency_hz,
+                                            target_hz, bandwidth)
+    return np.trapz(x=frequencies, y=amplitudes)
+
+
+def band_integrals(traces, sample_frequency_hz, target_hz, bandwidth):
+    '''
+    Integrate FFT amplitude within bandwidth around a target frequency for
+    many equal length traces with a single FFT call.
+
+    Args
+    ----
+
+        traces (numpy.ndarray) : 2-D array with one trace per row.
+        sample_frequency_hz (float) : Sampling frequency.
+        target_hz (float) : Target frequency.
+        bandwidth (float) : Bandwidth (centered at target frequency).
+
+    Returns
+    -------
+
+        (numpy.ndarray) : Integrated amplitude of each trace.
+    '''
+    traces = np.atleast_2d(np.asarray(traces, dtype=float))
+    N = traces.shape[1]
+    bins, frequencies = _band_bins(N, sample_frequency_hz, target_hz,
+                                   bandwidth)
+    amplitudes = np.abs(np.fft.rfft(traces, axis=1)[:, bins]) / N
+    return np.trapz(amplitudes, x=frequencies, axis=1)
+
+
+def experiment_type_from_commands(commands):
+    '''
+    Identify experiment type from DStat commands.
+
+    Parameters
+    ----------
+    commands : str
+        Commands as written in ``# DSTAT COMMANDS`` header of text files.
+
+    Returns
+    -------
+    str
+        Key of :data:`TEXT_COLUMNS`.
+    '''
+    letters = re.findall(r'E([A-Za-z0-9])', commands)
+    for letter in reversed(letters):
+        if letter in EXPERIMENT_COMMANDS:
+            experiment_type = EXPERIMENT_COMMANDS[letter]
+            if experiment_type == 'CA' and PD_COMMANDS.intersection(letters):
+                return 'PD'
+            return experiment_type
+    raise ValueError('No experiment command in: %s' % commands)
+
+
+def _unstack_scans(values, n_columns):
+    '''
+    Split rows of text file values into scans.
+
+    Rows hold column 0 of every scan, then column 1 of every scan, etc.
+    Rows with fewer values are assumed to be past the end of the last scans.
+
+    Returns
+    -------
+    list
+        ``(sample_index, values)`` array pair for each scan, where
+        ``values`` has one column per scan column.
+    '''
+    counts = np.isfinite(values).sum(axis=1) // n_columns
+    scans = []
+    for scan_i in range(values.shape[1] // n_columns):
+        rows = np.flatnonzero(counts > scan_i)
+        if not len(rows):
+            break
+        scan_values = np.empty((len(rows), n_columns))
+        # Position of column j of this scan depends on scans in each row
+        for active in np.unique(counts[rows]):
+            mask = counts[rows] == active
+            positions = np.arange(n_columns) * active + scan_i
+            scan_values[mask] = values[rows[mask]][:, positions]
+        scans.append((rows, scan_values))
+    return scans
+
+
 def dstat_to_frame(data_path_i):
     '''
     Convert DStat text file results to ``pandas.DataFrame``.
 
+    The header and data are read in a single pass, with the data parsed by
+    the ``pandas`` C parser.
+
     Parameters
     ----------
     data_path_i : str
-        Path to DStat results text file.
+        Path to DStat results text file (``*-data.txt``) of any experiment
+        type in :data:`TEXT_COLUMNS`.
 
     Returns
     -------
     pandas.DataFrame
-        DStat measurements in a table with the column ``name`` and
-        ``current_amps``, indexed by ``utc_timestamp`` and ``time_s``.
-
-    Notes
-    -----
-
-    **TODO** Currently only works for experiments with current as the only
-    measurement column (i.e., chronoamperometry, photodiode).
+        DStat measurements in a table with the columns ``name``,
+        ``experiment_type``, ``scan_i`` and the columns of the experiment
+        type in :data:`TEXT_COLUMNS`, indexed by ``utc_timestamp`` and the
+        first of these columns (e.g., ``time_s``).
     '''
-    with data_path_i.open('r') as input_i:
+    with open(data_path_i, 'r') as input_i:
         diff = (dt.datetime.utcnow() - dt.datetime.now())
         utc_timestamp = arrow.get(input_i.readline().split(' ')[-1]) + diff
 
-    str_data = StringIO.StringIO('\n'.join(l for l in data_path_i.lines()
-                                           if not l.startswith('#')))
-    df_data = pd.read_csv(str_data, sep='\s+', header=None)
-    df_data.rename(columns={0: 'time_s', 1: 'current_amps'}, inplace=True)
-    df_data.insert(0, 'name', re.sub(r'-data$', '', data_path_i.namebase))
-    df_data.insert(0, 'utc_timestamp', utc_timestamp.datetime +
-                   df_data.index.map(lambda v: dt.timedelta(seconds=v)))
-    df_data.set_index(['utc_timestamp', 'time_s'], inplace=True)
+        # Commands are on the line after `# DSTAT COMMANDS`
+        commands = ''
+        line = input_i.readline()
+        if line.startswith('# DSTAT COMMANDS'):
+            commands = input_i.readline()
+        experiment_type = experiment_type_from_commands(commands)
+        columns = TEXT_COLUMNS[experiment_type]
+
+        # Remaining comments (e.g., analysis) are skipped by the parser
+        df_values = pd.read_csv(input_i, delim_whitespace=True, header=None,
+                                comment='#', dtype=np.float64)
+
+    frames = []
+    for scan_i, (rows, values) in enumerate(
+            _unstack_scans(df_values.values, len(columns))):
+        frame_i = pd.DataFrame(values, columns=columns)
+        frame_i.insert(0, 'scan_i', scan_i)
+        frame_i.insert(0, 'utc_timestamp', utc_timestamp.datetime +
+                       pd.to_timedelta(rows, unit='s'))
+        frames.append(frame_i)
+
+    if frames:
+        df_data = pd.concat(frames, ignore_index=True)
+    else:
+        df_data = pd.DataFrame(None, columns=['utc_timestamp', 'scan_i'] +
+                               columns)
+    df_data.insert(1, 'name', re.sub(r'-data$', '', os.path.splitext(
+        os.path.basename(data_path_i))[0]))
+    df_data.insert(2, 'experiment_type', experiment_type)
+    df_data.set_index(['utc_timestamp', columns[0]], inplace=True)
     return df_data
 
 
+def dstat_dir_to_frame(data_dir, pattern='*-data.txt', processes=None):
+    '''
+    Load all DStat text files in a directory into one ``pandas.DataFrame``.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing DStat results text files.
+    pattern : str, optional
+        Glob pattern of files to load.
+    processes : int, optional
+        Number of worker processes.  Defaults to number of CPUs.  Files are
+        loaded in the calling process if ``1``.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Concatenated :func:`dstat_to_frame` tables, in order of file name.
+    '''
+    paths = sorted(glob.glob(os.path.join(data_dir, pattern)))
+    if not paths:
+        raise IOError('No files matching %s in %s' % (pattern, data_dir))
+
+    if processes == 1 or len(paths) == 1:
+        frames = map(dstat_to_frame, paths)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            frames = pool.map(dstat_to_frame, paths)
+        finally:
+            pool.close()
+            pool.join()
+    return pd.concat(frames)
+
+
+def _sync_signal(args):
+    '''
+    Integrated FFT amplitude of a synchronous detection experiment.
+
+    Args
+    ----
+
+        args (tuple) : `df_i`, `sample_frequency_hz`, `target_hz`,
+            `settling_period_s`, `bandwidth`.  Single argument for use with
+            `multiprocessing.Pool.map`.
+    '''
+    df_i, sample_frequency_hz, target_hz, settling_period_s, bandwidth = args
+    return band_integral(sync_trace(df_i, settling_period_s),
+                         sample_frequency_hz, target_hz, bandwidth)
+
+
 def reduce_dstat_data(df_dstat, groupby, settling_period_s=2., bandwidth=1.,
-                      summary_fields=[]):
+                      summary_fields=[], processes=None):
     '''
     Reduce measurements for each DStat experiment in `df_dstat` to a single
     row with an aggregate signal value.
 
     For continuous detection, the aggregate signal column corresponds to the
-    mean `current_amps`.
+    mean `current_amps`.  Means of all continuous detection experiments are
+    computed in a single grouped aggregation.
 
     For synchronous detection experiments (i.e., where `target_hz` is greater
     than 0), the aggregate signal corresponds to the integrated amplitude of
     the `current_amps` FFT within the bandwidth around target frequency.
+    These experiments are reduced in parallel in a process pool.
 
     Args
     ----
@@ -346,7 +684,11 @@ def reduce_dstat_data(df_dstat, groupby, settling_period_s=2., bandwidth=1.,
         bandwidth (float) : Bandwidth (centered at synchronous detection
             frequency) to integrate within.
         summary_fields (list) : List of columns to extract first value in each
-            group to include in each row of the output summary table.
+            group to include in each row of the output summary table.  Columns
+            that are also `groupby` columns are only included once.
+        processes (int) : Number of worker processes for synchronous
+            detection experiments.  Defaults to number of CPUs.  Computed in
+            the calling process if `1`.
 
     Returns
     -------
@@ -355,34 +697,52 @@ def reduce_dstat_data(df_dstat, groupby, settling_period_s=2., bandwidth=1.,
             `summary_fields` columns, and the column `signal` (i.e., the
             aggregate signal value).
     '''
-    rows = []
-
-    for index_i, df_i in df_dstat.groupby(groupby):
-        # Get `pandas.Series` containing summary metadata fields (not including signal).
-        summary_i = df_i.iloc[0][summary_fields].copy()
-        summary_i.name = index_i
-
-        if 'target_hz' in summary_i and summary_i['target_hz'] > 0:
-            # Synchronous detection (e.g., shuttered).
-            #
-            # Use FFT to integrate signal at bandwidth surrounding target synchonization
-            # frequency.
-            df_fft_i = dstat_to_fft_frame(df_i, sample_frequency_hz=
-                                          summary_i['sample_frequency_hz'],
-                                          settling_period_s=settling_period_s)
-            summary_i['signal'] = integrate_fft(df_fft_i,
-                                                summary_i['target_hz'],
-                                                bandwidth)
-        else:
-            # Continuous detection.
-            #
-            # Take mean measurement value (after settling period).
-            summary_i['signal'] = (df_i.loc[df_i.time_s > settling_period_s]
-                                   .current_amps.mean())
-        if isinstance(index_i, types.StringTypes):
-            index_i = [index_i]
+    if isinstance(groupby, types.StringTypes):
+        groupby = [groupby]
+
+    grouped = df_dstat.groupby(groupby)
+    # First row of each group (including missing values).  `nth` moves the
+    # `groupby` columns to the index, so move them back to use them as
+    # summary fields too.
+    df_first = grouped.nth(0)
+    keys = df_first.index
+    df_first = df_first.reset_index()
+
+    if 'target_hz' in summary_fields:
+        sync = (df_first['target_hz'] > 0).values
+    else:
+        sync = np.zeros(len(df_first), dtype=bool)
+
+    # Continuous detection.
+    #
+    # Take mean measurement value (after settling period).
+    settled = df_dstat.time_s.values > settling_period_s
+    means = (df_dstat.loc[settled].groupby(groupby).current_amps.mean()
+             .reindex(keys))
+    signal = means.values.astype(float)
+
+    # Synchronous detection (e.g., shuttered).
+    #
+    # Use FFT to integrate signal at bandwidth surrounding target synchonization
+    # frequency.
+    if sync.any():
+        jobs = [(grouped.get_group(keys[i]),
+                 df_first['sample_frequency_hz'].iat[i],
+                 df_first['target_hz'].iat[i],
+                 settling_period_s, bandwidth) for i in np.flatnonzero(sync)]
+
+        if processes == 1 or len(jobs) == 1:
+            signal[sync] = map(_sync_signal, jobs)
         else:
-            index_i = list(index_i)
-        rows.append(index_i + summary_i.tolist())
-
-    return pd.DataFrame(rows, columns=groupby + summary_i.keys().tolist())
+            pool = multiprocessing.Pool(processes)
+            try:
+                signal[sync] = pool.map(_sync_signal, jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+    # `groupby` columns already lead the table.
+    summary_fields = [i for i in summary_fields if i not in groupby]
+    df_summary = df_first[groupby + summary_fields].copy()
+    df_summary['signal'] = signal
+    return df_summary
@@ -1,35 +1,67 @@
+import io
 import logging
+import Queue
+import threading
 from time import sleep, time
 from os.path import expanduser
 from uuid import uuid4
 
+import numpy as np
 from BTrees.OOBTree import OOBTree
+from ZODB.blob import Blob
+from ZODB.interfaces import IBlobStorage
+from ZODB.POSException import ConflictError
 
 import mr_db.mr_db as db
 
 logger = logging.getLogger("dstat.db")
 
+# Measurements waiting to be written before submit blocks
+WRITER_QUEUE_SIZE = 64
+# Most measurements committed in one transaction
+WRITER_BATCH_SIZE = 16
+# Retries of a transaction after ConflictError, with doubling delay (s)
+CONFLICT_RETRIES = 5
+CONFLICT_BACKOFF = 0.1
+# Time allowed for a started ZEO server to accept connections and interval
+# between connection attempts (s)
+ZEO_START_TIMEOUT = 30
+ZEO_POLL_INTERVAL = 0.1
+# Time DatabaseWriter.add_results waits for its commit (s)
+COMMIT_TIMEOUT = 120
+
 current_db = None
 
 def start_db(path=None):
+    """Connects to database in background, reusing current connection if it
+    is for the same path and still usable. Returns immediately. A previous
+    connection finishes its pending writes and stops in the background
+    before the new one connects.
+    """
     global current_db
-    current_db = Database(data_dir=path)
+    path = path or None
+    previous = None
+    if current_db is not None:
+        if current_db.data_dir == path and current_db.connected:
+            return current_db
+        logger.info("Stopping ZEO in background")
+        previous = current_db
+        previous.stop(wait=False)
+    current_db = DatabaseWriter(data_dir=path, previous=previous)
+    return current_db
 
 def restart_db(object, path):
     logger.info("Restarting database")
     global current_db
     if current_db is None:
         logger.info("No database running")
-        start_db(path=path)
-    else:
-        stop_db()
-        start_db(path=path)
+    start_db(path=path)
 
 def stop_db():
     global current_db
     if not current_db is None:
         logger.info("Stopping ZEO")
-        current_db.disconnect()
+        current_db.stop() # Finishes pending writes and disconnects
         current_db = None
         db.stop_server()
     else:
@@ -45,6 +77,17 @@ class Database(object):
         self.db_connect(data_dir)
         
         self.db = self.connection.databases
+
+        # Store measurement arrays in blobs if ZEO has a blob directory,
+        # otherwise as compressed bytes in the measurement. ClientStorage
+        # provides IBlobStorage even without one, so also check blob_dir.
+        # The server may still lack one, so the first commit with blobs
+        # falls back to bytes if it fails.
+        storage = getattr(getattr(self.connection, 'db', None), 'storage',
+                          None)
+        self.blobs = (IBlobStorage.providedBy(storage) and
+                      getattr(storage, 'blob_dir', True) is not None)
+        self.blobs_tested = False  # Set once a commit with blobs succeeds
         
         # Make sure database exists
         if not self.db.has_key(name):
@@ -57,73 +100,136 @@ class Database(object):
         else:
             logger.war("Tried to disconnect ZEO when not connected")
     
-    def db_connect(self, root_dir):
-        """Connects to ZEO process. Starts ZEO if not running. Returns 
-        connection object.
+    def db_connect(self, root_dir, timeout=ZEO_START_TIMEOUT):
+        """Connects to ZEO process. Starts ZEO if not running and polls until
+        it accepts connections.
+
+        Raises:
+        ClientDisconnected -- if ZEO isn't ready after timeout (s)
         """
         if root_dir == '':
             root_dir = None
-        
-        while self.connected is False:
-            try:
-                self.connection = db.DbConnection(root_dir=root_dir)
-                self.connected = True
-                logger.info("Connected to ZEO server")
-            except db.ClientStorage.ClientDisconnected:
-                db.stop_server()
-                logger.info("Starting ZEO server -- root_dir = %s", root_dir)
-                db_proc = db.start_server(root_dir=root_dir)
-                sleep(3)
+
+        try:
+            self.connection = db.DbConnection(root_dir=root_dir)
+        except db.ClientStorage.ClientDisconnected:
+            db.stop_server()
+            logger.info("Starting ZEO server -- root_dir = %s", root_dir)
+            db_proc = db.start_server(root_dir=root_dir)
+
+            end = time() + timeout
+            while True:
+                sleep(ZEO_POLL_INTERVAL)
+                try:
+                    self.connection = db.DbConnection(root_dir=root_dir)
+                    break
+                except db.ClientStorage.ClientDisconnected:
+                    if time() >= end:
+                        logger.error("ZEO server not ready after %s s",
+                                     timeout)
+                        raise
+
+        self.connected = True
+        logger.info("Connected to ZEO server")
     
-    def add_results(self, measurement_uuid=None, measurement_name=None,
-                    experiment_uuid=None, experiment_metadata=None,
-                    patient_id=None,
-                    timestamp=None,
-                    data=None):
-                    
-        """Add a measurement"""
+    def add_results(self, **kwargs):
+        """Add a measurement in its own transaction. See _add_results for
+        arguments. Returns name of measurement.
+        """
+        return self.add_results_batch([kwargs])[0]
+
+    def add_results_batch(self, results, retries=CONFLICT_RETRIES):
+        """Add several measurements in one transaction. Retries the
+        transaction if it conflicts with another client's. If the first
+        transaction storing blobs fails, arrays are stored as bytes from then
+        on.
+
+        Arguments:
+        results -- list of dicts of keyword arguments of _add_results
+        retries -- number of times to retry after ConflictError
+
+        Returns:
+        list of names of measurements
+        """
+        try:
+            names = self._commit_results(results, retries)
+        except ConflictError:
+            raise
+        except Exception:
+            if not self.blobs or self.blobs_tested:
+                raise
+            logger.warning("Couldn't store blobs, storing arrays as bytes",
+                           exc_info=True)
+            self.blobs = False
+            try:
+                names = self._commit_results(results, retries)
+            except:
+                self.blobs = True  # Failed for another reason
+                raise
+
+        if self.blobs:
+            self.blobs_tested = True
+        return names
+
+    def _commit_results(self, results, retries):
+        """Commits results as in add_results_batch, without blob fallback."""
+        for attempt in range(retries + 1):
+            try:
+                logger.info("Starting DB transaction")
+                db.transaction.begin()
+                names = [self._add_results(**kwargs) for kwargs in results]
+                logger.info("Committing DB transaction")
+                db.transaction.commit()
+                return names
+
+            except ConflictError:
+                logger.warning("Conflict committing DB transaction")
+                db.transaction.abort()
+                if attempt == retries:
+                    raise
+                sleep(CONFLICT_BACKOFF * 2 ** attempt)
+
+            except:
+                logger.error("Aborting DB transaction")
+                db.transaction.abort()
+                raise
+
+    def _add_results(self, measurement_uuid=None, measurement_name=None,
+                     experiment_uuid=None, experiment_metadata=None,
+                     patient_id=None,
+                     timestamp=None,
+                     data=None):
+        """Add a measurement to current transaction"""
         
         if experiment_metadata is None:
             experiment_metadata = {}
             
-        try:
-            logger.info("Starting DB transaction")
-            db.transaction.begin()
+        logger.info("Creating Experiment with id: %s", experiment_uuid)
+        exp_db, exp_id = self.add_experiment(
+                                experiment_uuid=experiment_uuid,
+                                timestamp=timestamp,
+                                **experiment_metadata)
+
+        logger.info("Adding Measurement with id: %s", measurement_uuid)
+        name = self.add_dstat_measurement(experiment=exp_db[exp_id],
+                                   measurement_uuid=measurement_uuid,
+                                   name=measurement_name,
+                                   timestamp=timestamp,
+                                   data=data)
+    
+        if patient_id is not None:
+            if not patient_id in self.db['patients']:
+                logger.info("Creating patient with id: %s", patient_id)
+                patient = db.Patient(pid=patient_id)
+                self.db['patients'][patient_id] = patient
             
-            logger.info("Creating Experiment with id: %s", experiment_uuid)
-            exp_db, exp_id = self.add_experiment(
-                                    experiment_uuid=experiment_uuid,
-                                    timestamp=timestamp,
-                                    **experiment_metadata)
-
-            logger.info("Adding Measurement with id: %s", measurement_uuid)
-            name = self.add_dstat_measurement(experiment=exp_db[exp_id],
-                                       measurement_uuid=measurement_uuid,
-                                       name=measurement_name,
-                                       timestamp=timestamp,
-                                       data=data)
-        
-            if patient_id is not None:
-                if not patient_id in self.db['patients']:
-                    logger.info("Creating patient with id: %s", patient_id)
-                    patient = db.Patient(pid=patient_id)
-                    self.db['patients'][patient_id] = patient
-                
-                if not exp_id in self.db['patients'][patient_id].experiments:
-                    logger.info("Linking experiment into patient with id: %s",
-                                patient_id)    
-                    self.db['patients'][patient_id].link_experiment(exp_db,
-                                                                    exp_id)
-                
-            logger.info("Committing DB transaction")
-            db.transaction.commit()
+            if not exp_id in self.db['patients'][patient_id].experiments:
+                logger.info("Linking experiment into patient with id: %s",
+                            patient_id)    
+                self.db['patients'][patient_id].link_experiment(exp_db,
+                                                                exp_id)
             
-            return name
-        
-        except:
-            logger.error("Aborting DB transaction")
-            db.transaction.abort()
-            raise
+        return name
       
     def add_experiment(self, experiment_uuid=None, timestamp=None, **kwargs):
         """Add a new experiment. Will raise KeyExistsError if id is already
@@ -160,6 +266,7 @@ class Database(object):
             timestamp = time()
         if data is None:
             data = {}
+        data = dict(data) # Caller's copy is reused if transaction is retried
         
         if not 'measurements' in experiment:
             experiment['measurements'] = db.PersistentMapping()
@@ -175,6 +282,11 @@ class Database(object):
         
         if name is not None:
             data['name'] = name
+
+        # Own record, so browsing measurements doesn't load their arrays
+        if 'data' in data:
+            data['arrays'] = self._store_arrays(data.pop('data'))
+        data = db.PersistentMapping(data)
         
         experiment['measurements'][measurement_uuid] = data
         
@@ -191,4 +303,304 @@ class Database(object):
                    
             experiment['measurements_by_name'][name] = data
             
-        return name
\ No newline at end of file
+        return name
+
+    def _store_arrays(self, entries):
+        """Returns Blob (or bytes) of compressed .npz holding each scan of
+        each entry (e.g. 'data', 'ft') as a 2D array named "<entry>/<scan>".
+        """
+        arrays = {}
+        for entry, scans in entries.iteritems():
+            for number, scan in enumerate(scans):
+                arrays["%s/%s" % (entry, number)] = np.vstack(scan)
+
+        if not self.blobs:
+            f = io.BytesIO()
+            np.savez_compressed(f, **arrays)
+            return f.getvalue()
+
+        blob = Blob()
+        f = blob.open('w')
+        try:
+            np.savez_compressed(f, **arrays)
+        finally:
+            f.close()
+        return blob
+
+def measurement_arrays(measurement):
+    """Returns arrays of a stored measurement as a read-only mapping of
+    entry name (e.g. 'data') to list of scans (tuples of column arrays).
+    Arrays are only read when an entry is accessed. Measurements stored
+    before arrays were kept in blobs return their 'data' dict.
+    """
+    if 'arrays' not in measurement:
+        return measurement.get('data', {})
+    return MeasurementArrays(measurement['arrays'])
+
+class MeasurementArrays(object):
+    """Lazy access to arrays stored by Database._store_arrays."""
+    def __init__(self, stored):
+        self.stored = stored
+        self._files = None  # Member names, read once
+
+    def _open(self):
+        if isinstance(self.stored, Blob):
+            return self.stored.open('r')
+        return io.BytesIO(self.stored)
+
+    def _members(self):
+        if self._files is None:
+            f = self._open()
+            try:
+                self._files = np.load(f).files
+            finally:
+                f.close()
+        return self._files
+
+    def keys(self):
+        return sorted(set(i.rpartition('/')[0] for i in self._members()))
+
+    def __contains__(self, entry):
+        return entry in self.keys()
+
+    def __getitem__(self, entry):
+        f = self._open()
+        try:
+            npz = np.load(f)
+            self._files = npz.files
+            scans = {}
+            for member in npz.files:
+                name, _sep, number = member.rpartition('/')
+                if name == entry:
+                    scans[int(number)] = tuple(npz[member])
+        finally:
+            f.close()
+
+        if not scans:
+            raise KeyError(entry)
+        return [scans[i] for i in sorted(scans)]
+
+class DatabaseWriter(object):
+    """Writes measurements to a Database from a dedicated thread, so callers
+    never wait for ZEO. The Database is created, used and disconnected only
+    in that thread. Measurements waiting in the queue when the thread is
+    free are committed together in one transaction.
+    """
+    def __init__(self, name='dstat', data_dir=None,
+                 maxsize=WRITER_QUEUE_SIZE, batch_size=WRITER_BATCH_SIZE,
+                 retries=CONFLICT_RETRIES, previous=None):
+        """Starts writer thread, which connects to the database.
+
+        Arguments:
+        maxsize -- number of measurements queued before submit blocks
+        batch_size -- most measurements committed in one transaction
+        retries -- number of times to retry a transaction after
+            ConflictError
+        previous -- stopping DatabaseWriter whose thread is waited for and
+            whose ZEO server is stopped before connecting
+        """
+        self.name = name
+        self.data_dir = data_dir
+        self.previous = previous
+        self.batch_size = batch_size
+        self.retries = retries
+
+        self.queue = Queue.Queue(maxsize)
+        self.database = None
+        self.error = None  # Exception raised when connecting or writing
+        self.ready = threading.Event()  # Set once connecting has finished
+
+        self.commits = 0
+        self.measurements = 0
+        self.last_latency = None
+        self.max_latency = 0.
+        self.total_latency = 0.
+
+        self.thread = threading.Thread(target=self._run, name="dstat-db")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def connected(self):
+        """True unless connecting failed or writer has stopped."""
+        return self.thread.is_alive() and self.error is None
+
+    def wait_ready(self, timeout=None):
+        """Wait until connecting has finished. Returns True if connected."""
+        self.ready.wait(timeout)
+        return self.ready.is_set() and self.database is not None
+
+    def submit(self, callback=None, **kwargs):
+        """Queue a measurement. Blocks only if the queue is full.
+
+        Arguments:
+        callback -- called in writer thread as callback(name, error) after
+            the measurement is committed (error None) or failed (name None)
+        kwargs -- keyword arguments of Database.add_results
+        """
+        self.queue.put((kwargs, callback))
+
+    def add_results(self, timeout=COMMIT_TIMEOUT, **kwargs):
+        """Queue a measurement and wait until it is committed. Returns name
+        of measurement. Raises exception of failed commit.
+
+        Arguments:
+        timeout -- seconds to wait for commit, None to wait as long as the
+            writer thread is running. If the thread stops or the timeout
+            expires first, its stored error (or RuntimeError) is raised.
+        """
+        done = threading.Event()
+        result = {}
+
+        def callback(name, error):
+            result['name'] = name
+            result['error'] = error
+            done.set()
+
+        self.submit(callback=callback, **kwargs)
+
+        if timeout is not None:
+            end = time() + timeout
+        while not done.wait(ZEO_POLL_INTERVAL):
+            if not self.thread.is_alive():
+                message = "Database writer stopped"
+            elif timeout is not None and time() >= end:
+                message = "Measurement not committed after %s s" % timeout
+            else:
+                continue
+            if self.error is not None:
+                raise self.error
+            raise RuntimeError(message)
+
+        if result['error'] is not None:
+            raise result['error']
+        return result['name']
+
+    def flush(self, timeout=None):
+        """Wait until all queued measurements have been written.
+
+        Returns:
+        False if timeout (s) expired first, otherwise True
+        """
+        if timeout is not None:
+            end = time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                if timeout is None:
+                    self.queue.all_tasks_done.wait()
+                else:
+                    remaining = end - time()
+                    if remaining <= 0:
+                        return False
+                    self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    wait = flush
+
+    def stop(self, wait=True):
+        """Write queued measurements, disconnect and stop thread.
+
+        Arguments:
+        wait -- if False, return immediately and let the thread finish on
+            its own
+        """
+        self.queue.put(None)
+        if wait:
+            self.thread.join()
+
+    def stats(self):
+        """Returns dict of queue depth and commit latency (s)."""
+        return {'queue_depth': self.queue.qsize(),
+                'pending': self.queue.unfinished_tasks,
+                'commits': self.commits,
+                'measurements': self.measurements,
+                'last_latency': self.last_latency,
+                'mean_latency': (self.total_latency / self.commits
+                                 if self.commits else None),
+                'max_latency': self.max_latency}
+
+    def _run(self):
+        if self.previous is not None:
+            # Let previous connection finish writing before its server stops
+            self.previous.thread.join()
+            db.stop_server()
+            self.previous = None
+
+        try:
+            self.database = Database(name=self.name, data_dir=self.data_dir)
+        except Exception as err:
+            logger.exception("Couldn't connect to database")
+            self.error = err
+        self.ready.set()
+
+        try:
+            self._write_queue()
+        except Exception as err:
+            logger.exception("Database writer failed")
+            self.error = err
+
+    def _write_queue(self):
+        """Writes queued measurements until stopped."""
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if batch[-1] is None:
+                stopping = True
+
+            items = [i for i in batch if i is not None]
+            if items:
+                self._write(items)
+            for i in batch:
+                self.queue.task_done()
+
+        if self.database is not None:
+            self.database.disconnect()
+
+    def _write(self, items):
+        """Commit items of queue, individually if the batch fails."""
+        if self.database is None:
+            results = [(None, self.error)] * len(items)
+        else:
+            start = time()
+            try:
+                names = self.database.add_results_batch(
+                    [kwargs for kwargs, callback in items], self.retries)
+                results = [(name, None) for name in names]
+            except Exception as err:
+                results = [(None, err)]
+                if len(items) > 1: # Don't lose batch to one measurement
+                    logger.warning("Batch commit failed, writing "
+                                   "measurements individually")
+                    results = []
+                    for kwargs, callback in items:
+                        try:
+                            results.append((self.database.add_results_batch(
+                                [kwargs], self.retries)[0], None))
+                        except Exception as err:
+                            results.append((None, err))
+            self._record(time() - start, len(items))
+
+        for (kwargs, callback), (name, error) in zip(items, results):
+            if error is not None:
+                logger.error("Couldn't write measurement %s: %s",
+                             kwargs.get('measurement_uuid'), error)
+            if callback is not None:
+                try:
+                    callback(name, error)
+                except Exception:
+                    logger.exception("Database writer callback failed")
+
+    def _record(self, latency, count):
+        self.commits += 1
+        self.measurements += count
+        self.last_latency = latency
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        logger.info("Committed %s measurements in %.3f s, %s queued",
+                    count, latency, self.queue.qsize())
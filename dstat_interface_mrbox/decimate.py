@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Min/max decimation of data for plotting.
+"""
+import numpy as np
+
+from scan_store import ScanStore
+
+def block_extrema(y, start, count, width):
+    """Returns (imin, imax, vmin, vmax), the indices and values of the
+    minimum and maximum of each of count blocks of width samples of y,
+    starting at sample start.
+    """
+    y = np.asarray(y)
+    blocks = y[start:start + count * width].reshape(count, width)
+    base = start + width * np.arange(count)
+    low = blocks.argmin(axis=1)
+    high = blocks.argmax(axis=1)
+    rows = np.arange(count)
+    return (base + low, base + high, blocks[rows, low], blocks[rows, high])
+
+def ordered_indices(imin, imax):
+    """Returns sorted indices to draw from the minimum and maximum index of
+    each block, keeping both in the order they occurred.
+    """
+    index = np.column_stack((np.minimum(imin, imax),
+                             np.maximum(imin, imax))).ravel()
+    if not len(index):
+        return index
+    # Drop repeats from blocks where min and max are the same sample
+    return index[np.concatenate(([True], np.diff(index) != 0))]
+
+def envelope(x, y, buckets=1000):
+    """Returns (x, y) reduced to the min and max of at most buckets blocks
+    of equal width, so peaks stay visible however many samples are
+    reduced. Samples after the last complete block form one more block.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(y) <= 2 * buckets:
+        return x, y
+
+    width = -(-len(y) // buckets)
+    count = len(y) // width
+    imin, imax, _vmin, _vmax = block_extrema(y, 0, count, width)
+    tail = count * width
+    if tail < len(y):
+        imin = np.append(imin, tail + y[tail:].argmin())
+        imax = np.append(imax, tail + y[tail:].argmax())
+    index = ordered_indices(imin, imax)
+    return x[index], y[index]
+
+class TracePyramid(object):
+    """Multi-resolution index of a trace. Level k holds the minimum,
+    maximum and sum of each block of 2**k samples. Level 1 is the envelope
+    of sample pairs (block_extrema) and each higher level is built from
+    pairs of blocks of level k-1 as samples arrive. Queries pick the
+    coarsest level that still gives about one block per bucket over the
+    requested range, so drawing cost doesn't depend on trace length or
+    zoom.
+
+    Lines are drawn from the minimum and maximum of each block in the order
+    they occurred, which keeps peaks visible at any level.
+    """
+    # Columns of each level
+    IMIN, IMAX, VMIN, VMAX, SUM = range(5)
+
+    def __init__(self):
+        self.levels = []
+        self.n = 0
+        self.monotonic = True
+
+    def update(self, x, y):
+        """Adds samples after the ones already seen.
+
+        Arguments:
+        x, y -- arrays of all samples so far (earlier samples must not
+            change)
+        """
+        x = np.asarray(x)
+        y = np.asarray(y)
+        total = len(y)
+        if total <= self.n:
+            return
+
+        if self.monotonic:
+            start = max(self.n - 1, 0)
+            self.monotonic = not np.any(np.diff(x[start:total]) < 0)
+
+        count = total
+        k = 0
+        while count >= 2:
+            if len(self.levels) <= k:
+                self.levels.append(ScanStore(5, count // 2))
+            level = self.levels[k]
+            done = level.samples(0)
+            available = count // 2
+
+            if available > done:
+                if k == 0:
+                    # Envelope of sample pairs
+                    level.extend(0, block_extrema(y, 2 * done,
+                                                  available - done, 2) +
+                                 (y[2 * done:2 * available].reshape(-1, 2)
+                                  .sum(axis=1),))
+                else:
+                    below = self.levels[k - 1][0]
+                    level.extend(0, self._combine(below, done, available))
+            count = available
+            k += 1
+
+        self.n = total
+
+    def _combine(self, below, start, stop):
+        """Returns columns of blocks start:stop made from pairs of blocks
+        in level below.
+        """
+        def pairs(column):
+            return below[column][2 * start:2 * stop].reshape(-1, 2)
+
+        rows = np.arange(stop - start)
+        vmin = pairs(self.VMIN)
+        vmax = pairs(self.VMAX)
+        low = vmin.argmin(axis=1)
+        high = vmax.argmax(axis=1)
+        return (pairs(self.IMIN)[rows, low], pairs(self.IMAX)[rows, high],
+                vmin[rows, low], vmax[rows, high],
+                pairs(self.SUM).sum(axis=1))
+
+    def means(self, k):
+        """Returns mean of each block of 2**k samples."""
+        if k == 0:
+            raise ValueError("Level 0 is the trace itself.")
+        return self.levels[k - 1][0][self.SUM] / 2 ** k
+
+    def index_range(self, x, xmin=None, xmax=None):
+        """Returns (start, stop) indices of samples covering xmin to xmax,
+        including one sample beyond each end. Whole trace if x isn't
+        monotonic or no range is given.
+        """
+        if xmin is None or xmax is None or not self.monotonic:
+            return 0, self.n
+        x = np.asarray(x)[:self.n]
+        start = max(np.searchsorted(x, xmin, 'left') - 1, 0)
+        stop = min(np.searchsorted(x, xmax, 'right') + 1, self.n)
+        return start, stop
+
+    def indices(self, y, start, stop, buckets):
+        """Returns sorted indices of samples to draw between start and stop
+        with about buckets blocks.
+        """
+        y = np.asarray(y)
+        span = stop - start
+        k = 0
+        while (span >> k) > buckets and k < len(self.levels):
+            k += 1
+
+        if k == 0:
+            return np.arange(start, stop)
+
+        level = self.levels[k - 1][0]
+        first = start >> k
+        last = min((stop + (1 << k) - 1) >> k, len(level[0]))
+        imin = level[self.IMIN][first:last].astype(np.int64)
+        imax = level[self.IMAX][first:last].astype(np.int64)
+
+        # Samples not yet in a complete block
+        tail = max(last << k, start)
+        if tail < stop:
+            imin = np.append(imin, tail + y[tail:stop].argmin())
+            imax = np.append(imax, tail + y[tail:stop].argmax())
+
+        return ordered_indices(imin, imax)
+
+    def query(self, x, y, xmin=None, xmax=None, buckets=1000):
+        """Returns (x, y) to draw for the range xmin to xmax."""
+        start, stop = self.index_range(x, xmin, xmax)
+        index = self.indices(y, start, stop, buckets)
+        return np.asarray(x)[index], np.asarray(y)[index]
@@ -20,17 +20,116 @@
 import serial
 from serial.tools import list_ports
 import time
+import bisect
+from collections import deque, OrderedDict
+from datetime import datetime
+import select
+import sys
 import struct
 import multiprocessing as mp
+try:
+    from multiprocessing.connection import wait as _wait
+except ImportError:  # Python 2
+    _wait = None
+import ctypes
 import logging
 
-from errors import InputError, VarError
+import numpy as np
+
+from errors import InputError, VarError, HandshakeError
+from scan_store import ScanStore
 
 logger = logging.getLogger("dstat.comm")
 dstat_logger = logging.getLogger("dstat.comm.DSTAT")
 exp_logger = logging.getLogger("dstat.comm.Experiment")
 
-def _serial_process(ser_port, proc_pipe, ctrl_pipe, data_pipe):
+# Seconds SharedRingBuffer.send waits for the reader to make space before
+# dropping samples.
+RING_BUFFER_TIMEOUT = 1.
+
+# Bytes of a command the DStat firmware buffers before parsing them, one
+# full speed USB packet.
+RX_BUFFER_SIZE = 64
+# Oldest DStat version whose firmware takes commands in RX_BUFFER_SIZE
+# chunks. Older versions get one character at a time.
+CHUNKED_WRITE_VERSION = (1, 2)
+
+
+class LatencyHistogram(object):
+    """Counts latencies (in seconds) in buckets bounded by bounds."""
+    def __init__(self, bounds=(.001, .002, .005, .01, .02, .05, .1, .2, .5,
+                               1.)):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, latency):
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+
+    def __str__(self):
+        labels = ["<%gms" % (i * 1000) for i in self.bounds]
+        labels.append(">=%gms" % (self.bounds[-1] * 1000))
+        return " ".join("%s:%s" % (label, count) for label, count
+                        in zip(labels, self.counts) if count)
+
+handshake_latency = LatencyHistogram()
+command_latency = LatencyHistogram()
+
+def handshake(ser, timeout=.05, max_timeout=1., attempts=8):
+    """Sends '!' to DStat and waits for 'C'. The first attempt waits timeout
+    seconds, each retry doubles the wait up to max_timeout. Returns
+    handshake latency in seconds.
+
+    Raises HandshakeError if DStat did not answer after attempts tries.
+    """
+    old_timeout = ser.timeout
+    wait = timeout
+    start = time.time()
+
+    try:
+        for attempt in range(1, attempts + 1):
+            ser.flushInput()
+            if ser.timeout != wait:
+                ser.timeout = wait
+            ser.write('!')
+
+            if ser.read() == "C":
+                latency = time.time() - start
+                handshake_latency.add(latency)
+                logger.debug("Handshake: %.2f ms, %s attempts",
+                             latency * 1000, attempt)
+                return latency
+
+            wait = min(wait * 2, max_timeout)
+
+        raise HandshakeError(attempts, "DStat did not answer handshake")
+
+    finally:
+        if ser.timeout != old_timeout:
+            ser.timeout = old_timeout
+
+def wait_connections(connections, timeout=None):
+    """Blocks until at least one of connections has data to receive or
+    timeout seconds have passed. Returns list of ready connections.
+    """
+    if _wait is not None:
+        return _wait(connections, timeout)
+    if sys.platform != 'win32':
+        return select.select(connections, [], [], timeout)[0]
+
+    # Pipes can't be selected on Windows. Block on the last connection
+    # and check the others every 100 ms.
+    start = time.time()
+    while True:
+        ready = [i for i in connections[:-1] if i.poll()]
+        if ready:
+            return ready
+        if connections[-1].poll(.1):
+            return [connections[-1]]
+        if timeout is not None and time.time() - start >= timeout:
+            return []
+
+def _serial_process(ser_port, proc_pipe, ctrl_pipe, data_pipe,
+                    ring_buffer=None):
     ser_logger = logging.getLogger("dstat.comm._serial_process")
     
     ser = delayedSerial(ser_port, baudrate=1000000, timeout=1)
@@ -39,22 +138,20 @@ def _serial_process(ser_port, proc_pipe, ctrl_pipe, data_pipe):
     
     ser.write("ck")
     
-    ser.flushInput()
-    ser.write('!')
-    
-    for i in range(10):
-        if not ser.read()=="C":
-            time.sleep(.5)
-            ser.write('!')
-        else:
-            break
+    try:
+        handshake(ser, attempts=10)
+    except HandshakeError as err:
+        ser_logger.error("HandshakeError: %s", err)
 
     while True:
+        # Sleep until a control message or job arrives
+        wait_connections([ctrl_pipe, proc_pipe])
+
         # These can only be called when no experiment is running
         if ctrl_pipe.poll(): 
             ctrl_buffer = ctrl_pipe.recv()
             
-            if ctrl_buffer == ('a' or "DISCONNECT"):
+            if ctrl_buffer in ('a', "DISCONNECT"):
                 proc_pipe.send("ABORT")
                 ser.write('a')
                 ser_logger.info("ABORT")
@@ -69,26 +166,368 @@ def _serial_process(ser_port, proc_pipe, ctrl_pipe, data_pipe):
             while ctrl_pipe.poll():
                 ctrl_pipe.recv()
             
-            return_code = proc_pipe.recv().run(ser, ctrl_pipe, data_pipe)
+            job = proc_pipe.recv()
+            # Only set for jobs sent with SerialConnection.submit
+            submitted = getattr(job, 'submitted', None)
+            if submitted is not None:
+                ser_logger.info("%s waited %.1f ms in queue",
+                                type(job).__name__,
+                                (time.time() - submitted) * 1000)
+            if ring_buffer is not None and isinstance(job, Experiment):
+                job.ring_buffer = ring_buffer
+
+            return_code = job.run(ser, ctrl_pipe, data_pipe)
             ser_logger.info('Return code: %s', str(return_code))
+            ser_logger.info('Handshake latency: %s', handshake_latency)
+            ser_logger.info('Command latency: %s', command_latency)
+
+            # Disconnect requested while experiment was running
+            if return_code == "DISCONNECT":
+                proc_pipe.send("ABORT")
+                ser_logger.info("DISCONNECT")
+                ser.close()
+                proc_pipe.send("DISCONNECT")
+                return False
 
             proc_pipe.send(return_code)
-        
-        else:
-            time.sleep(.1)
             
 
 
 class SerialConnection(object):
-    def __init__(self, ser_port):
+    def __init__(self, ser_port, ring_buffer_size=None):
+        """Starts serial process for ser_port. If ring_buffer_size is given,
+        experiment data is passed through a SharedRingBuffer holding that
+        many samples instead of being pickled through data_pipe.
+        """
         self.proc_pipe_p, self.proc_pipe_c = mp.Pipe(duplex=True)
         self.ctrl_pipe_p, self.ctrl_pipe_c = mp.Pipe(duplex=True)
         self.data_pipe_p, self.data_pipe_c = mp.Pipe(duplex=True)
+
+        if ring_buffer_size:
+            self.ring_buffer = SharedRingBuffer(ring_buffer_size)
+        else:
+            self.ring_buffer = None
     
         self.proc = mp.Process(target=_serial_process, args=(ser_port,
                                 self.proc_pipe_c, self.ctrl_pipe_c,
-                                self.data_pipe_c))
+                                self.data_pipe_c, self.ring_buffer))
         self.proc.start()
+
+        self.version = None
+        self.settings = {}
+
+    def submit(self, job):
+        """Sends job (an object with a run(ser, ctrl_pipe, data_pipe)
+        method) to the serial process. Time of submission is recorded to
+        report queueing delay.
+        """
+        job.submitted = time.time()
+        self.proc_pipe_p.send(job)
+
+    def flush_data(self):
+        """Discards anything left in data_pipe."""
+        while self.data_pipe_p.poll():
+            self.data_pipe_p.recv()
+
+    def call(self, job, action):
+        """Runs job in serial process and waits for its return code.
+        Raises serial.SerialException if job doesn't return "DONE".
+
+        Arguments:
+        job -- object with a run(ser, ctrl_pipe, data_pipe) method
+        action -- description of job for log and error messages
+        """
+        self.flush_data()
+        self.submit(job)
+        status = self.proc_pipe_p.recv()
+        logger.debug("%s: %s", action, status)
+
+        if status != "DONE":
+            raise serial.SerialException("Could not %s: %s" % (action, status))
+
+    def version_check(self):
+        """Gets DStat version and stores it in self.version. Returns tuple of
+        (major, minor).
+        """
+        self.call(VersionCheck(), "read version")
+        self.version = self.data_pipe_p.recv()
+        return self.version
+
+    def read_settings(self):
+        """Reads DStat settings into self.settings. Returns settings dict."""
+        self.call(Settings(task='r'), "read settings")
+        self.settings = self.data_pipe_p.recv()
+        return self.settings
+
+    def write_settings(self, settings=None):
+        """Writes settings (default self.settings) to DStat."""
+        if settings is None:
+            settings = self.settings
+        self.call(Settings(task='w', settings=settings), "write settings")
+
+    def read_light_sensor(self):
+        """Returns light sensor clear channel reading."""
+        self.call(LightSensor(), "read light sensor")
+        return self.data_pipe_p.recv()
+
+    def measure_offset(self, time):
+        """Measures current offset for each gain setting. Returns dict of
+        offsets keyed by the name of the gain's trim setting.
+        """
+        gain_trim_table = [None, 'r100_trim', 'r3k_trim', 'r30k_trim',
+                           'r300k_trim', 'r3M_trim', 'r30M_trim',
+                           'r100M_trim']
+
+        parameters = {}
+        parameters['time'] = time
+
+        gain_offset = {}
+
+        for i in range(1,8):
+            parameters['gain'] = i
+            self.call(CALExp(parameters), "measure offset")
+            gain_offset[gain_trim_table[i]] = self.data_pipe_p.recv()
+
+        return gain_offset
+
+    def new_experiment(self, experiment_class, parameters):
+        """Returns an instance of experiment_class using this DStat's
+        version and gain trim settings.
+        """
+        parameters = dict(parameters)
+        parameters['version'] = self.version
+        return experiment_class(parameters, settings=self.settings)
+
+    def disconnect(self):
+        """Aborts any running experiment and stops serial process."""
+        self.ctrl_pipe_p.send("DISCONNECT")
+        self.proc.join(1)
+        if self.proc.is_alive():
+            self.proc.terminate()
+
+class DeviceManager(object):
+    """Drives several DStats at once. Each one has its own SerialConnection
+    with its own serial process, version and settings.
+    """
+    def __init__(self, ring_buffer_size=None):
+        self.ring_buffer_size = ring_buffer_size
+        self.devices = OrderedDict()
+        self.running = {}
+
+    def __getitem__(self, key):
+        return self.devices[key]
+
+    def __iter__(self):
+        return iter(self.devices)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def connect(self, ser_port, key=None):
+        """Connects to DStat on ser_port and reads its version and settings.
+        Returns SerialConnection.
+
+        Arguments:
+        ser_port -- address of serial port to use
+        key -- name used to refer to device, defaults to ser_port
+        """
+        if key is None:
+            key = ser_port
+        if key in self.devices:
+            raise InputError(key, "Device already connected.")
+
+        connection = SerialConnection(ser_port, self.ring_buffer_size)
+        try:
+            connection.version_check()
+            connection.read_settings()
+        except:
+            connection.disconnect()
+            raise
+
+        self.devices[key] = connection
+        logger.info("%s: DStat version %s.%s", key, *connection.version)
+        return connection
+
+    def disconnect(self, key=None):
+        """Disconnects device key, or all devices if key is None."""
+        if key is None:
+            keys = list(self.devices)
+        else:
+            keys = [key]
+
+        for key in keys:
+            self.devices.pop(key).disconnect()
+            self.running.pop(key, None)
+
+    def start(self, experiments):
+        """Starts experiments on several devices in parallel.
+
+        Arguments:
+        experiments -- dict of device key: Experiment or list of Experiments
+            to run back-to-back on that device.
+        """
+        for key, jobs in experiments.iteritems():
+            if key in self.running:
+                raise InputError(key, "Device is busy.")
+            if isinstance(jobs, Experiment):
+                jobs = [jobs]
+
+            self.devices[key].flush_data()
+            self.devices[key].submit(ExperimentBatch(jobs))
+            self.running[key] = []
+
+    def abort(self, key=None):
+        """Aborts experiments on device key, or all devices if key is None."""
+        for i in ([key] if key is not None else list(self.running)):
+            self.devices[i].ctrl_pipe_p.send('a')
+
+    def collect(self, timeout=None):
+        """Waits for experiments started with start() to finish.
+
+        Arguments:
+        timeout -- seconds to wait, None waits until all devices are done
+
+        Returns:
+        dict of device key: (status, list of BatchResults) for every device
+        that finished.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        results = {}
+
+        while self.running:
+            connections = {}
+            for key in self.running:
+                connections[self.devices[key].data_pipe_p] = key
+                connections[self.devices[key].proc_pipe_p] = key
+
+            if timeout is None:
+                ready = wait_connections(list(connections))
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                ready = wait_connections(list(connections), remaining)
+
+            for conn in ready:
+                key = connections[conn]
+                if key not in self.running:
+                    continue
+                device = self.devices[key]
+
+                while device.data_pipe_p.poll():
+                    result = device.data_pipe_p.recv()
+                    if isinstance(result, BatchResult):
+                        self.running[key].append(result)
+
+                if conn is device.proc_pipe_p:
+                    status = device.proc_pipe_p.recv()
+                    while device.data_pipe_p.poll():
+                        result = device.data_pipe_p.recv()
+                        if isinstance(result, BatchResult):
+                            self.running[key].append(result)
+                    results[key] = (status, self.running.pop(key))
+
+        return results
+
+class SharedRingBuffer(object):
+    """Single producer, single consumer ring buffer of samples in shared
+    memory. Each row holds the scan number followed by up to width-1 data
+    columns. The serial process writes with send() and the GUI process reads
+    with read(); the write counter doubles as notification so no data is
+    pickled. When the buffer is full, send() waits up to timeout seconds for
+    the reader. Samples that still don't fit are dropped and counted in
+    dropped.
+    """
+    def __init__(self, capacity, width=5, timeout=RING_BUFFER_TIMEOUT):
+        self.capacity = capacity
+        self.width = width
+        self.timeout = timeout
+        self._array = mp.RawArray(ctypes.c_double, capacity * width)
+        self._written = mp.RawValue(ctypes.c_uint64, 0)
+        self._read = mp.RawValue(ctypes.c_uint64, 0)
+        self._dropped = mp.RawValue(ctypes.c_uint64, 0)
+        self._rows = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_rows'] = None
+        return state
+
+    @property
+    def rows(self):
+        """Array view of shared memory, created once per process."""
+        if self._rows is None:
+            self._rows = np.frombuffer(self._array, dtype=np.float64).reshape(
+                            self.capacity, self.width)
+        return self._rows
+
+    @property
+    def available(self):
+        """Number of samples waiting to be read."""
+        return self._written.value - self._read.value
+
+    @property
+    def dropped(self):
+        """Total number of samples dropped because buffer was full."""
+        return self._dropped.value
+
+    def send(self, block):
+        """Writes a (scan, columns) block. Same interface as
+        multiprocessing Connection.send so it can replace data_pipe.
+        """
+        scan, columns = block
+        length = len(columns[0])
+        done = 0
+        deadline = None
+
+        while done < length:
+            written = self._written.value
+            free = self.capacity - (written - self._read.value)
+
+            if not free:
+                # Hold back the serial process until the reader catches up
+                if deadline is None:
+                    deadline = time.time() + self.timeout
+                elif time.time() >= deadline:
+                    self._dropped.value += length - done
+                    logger.warning("SharedRingBuffer full, dropped %s samples",
+                                   length - done)
+                    return
+                time.sleep(.001)
+                continue
+
+            start = written % self.capacity
+            count = min(length - done, free, self.capacity - start)
+            rows = self.rows[start:start + count]
+            rows[:, 0] = scan
+            for i, column in enumerate(columns):
+                rows[:, i + 1] = column[done:done + count]
+            done += count
+            self._written.value = written + count
+
+    def read(self, ncols):
+        """Generator of (scan, columns) blocks of all samples written so
+        far. columns are ncols views into shared memory that are valid until
+        the next block is requested.
+        """
+        written = self._written.value
+        read = self._read.value
+
+        while read < written:
+            start = read % self.capacity
+            count = min(written - read, self.capacity - start)
+            rows = self.rows[start:start + count]
+
+            scans = rows[:, 0]
+            bounds = ([0] + (np.flatnonzero(scans[1:] != scans[:-1]) + 1)
+                      .tolist() + [count])
+            for i, j in zip(bounds[:-1], bounds[1:]):
+                yield (int(scans[i]),
+                       tuple(rows[i:j, k + 1] for k in range(ncols)))
+
+            read += count
+            self._read.value = read
         
 
 class VersionCheck:
@@ -103,13 +542,7 @@ class VersionCheck:
         ser_port -- address of serial port to use
         """
         try:
-            ser.flushInput()
-            ser.write('!')
-                
-            while not ser.read()=="C":
-                ser.flushInput()
-                ser.write('!')
-                
+            handshake(ser)
             ser.write('V')
             for line in ser:
                 if line.startswith('V'):
@@ -125,36 +558,41 @@ class VersionCheck:
             e = "PCB version: "
             e += str(input.rstrip())
             dstat_logger.info(e)
-            
-            data_pipe.send((int(parted[0]), int(parted[1])))
+
+            version = (int(parted[0]), int(parted[1]))
+            if version >= CHUNKED_WRITE_VERSION:
+                ser.chunk_size = RX_BUFFER_SIZE
+            data_pipe.send(version)
             status = "DONE"
         
         except UnboundLocalError as e:
             status = "SERIAL_ERROR"
-        except SerialException as e:
+        except serial.SerialException as e:
             logger.error('SerialException: %s', e)
             status = "SERIAL_ERROR"
+        except HandshakeError as e:
+            logger.error('HandshakeError: %s', e)
+            status = "SERIAL_ERROR"
         
         finally:
             return status
 
-def version_check(ser_port):
+def version_check(ser_port, ring_buffer_size=None):
     """Tries to contact DStat and get version. Returns a list of
     [(major, minor), serial instance]. If no response, returns empty tuple.
         
     Arguments:
     ser_port -- address of serial port to use
+    ring_buffer_size -- samples in shared memory buffer, None to use pipe
     """
     try:        
         global serial_instance
-        serial_instance = SerialConnection(ser_port)
+        serial_instance = SerialConnection(ser_port, ring_buffer_size)
         
-        serial_instance.proc_pipe_p.send(VersionCheck())
-        result = serial_instance.proc_pipe_p.recv()
-        if result == "SERIAL_ERROR":
+        try:
+            buffer = serial_instance.version_check()
+        except serial.SerialException:
             buffer = 1
-        else:
-            buffer = serial_instance.data_pipe_p.recv()
         logger.debug("version_check done")
         
         return buffer
@@ -174,26 +612,25 @@ class Settings:
         
         self.ser = ser
         
-        if 'w' in self.task:
-            self.write()
+        try:
+            if 'w' in self.task:
+                self.write()
+                
+            if 'r' in self.task:
+                data_pipe.send(self.read())
             
-        if 'r' in self.task:
-            data_pipe.send(self.read())
+            status = "DONE"
         
-        status = "DONE"
+        except HandshakeError as e:
+            logger.error('HandshakeError: %s', e)
+            status = "SERIAL_ERROR"
         
         return status
         
     def read(self):
         settings = {}
         
-        self.ser.flushInput()
-        self.ser.write('!')
-                
-        while not self.ser.read()=="C":
-            self.ser.flushInput()
-            self.ser.write('!')
-            
+        handshake(self.ser)
         self.ser.write('SR')
         for line in self.ser:
             if line.lstrip().startswith('S'):
@@ -213,53 +650,40 @@ class Settings:
         return settings
         
     def write(self):
-        self.ser.flushInput()
-        self.ser.write('!')
-                
-        while not self.ser.read()=="C":
-            self.ser.flushInput()
-            self.ser.write('!')
+        handshake(self.ser)
             
         write_buffer = range(len(self.settings))
     
         for i in self.settings: # make sure settings are in right order
             write_buffer[self.settings[i][0]] = self.settings[i][1]
         
-        self.ser.write('SW')
-        for i in write_buffer:
-            self.ser.write(i)
-            self.ser.write(' ')
+        self.ser.write("".join(['SW'] + ["%s " % i for i in write_buffer]))
         
         return
         
+# Settings of default connection, filled in by read_settings()
+settings = {}
+
 def read_settings():
-    """Tries to contact DStat and get settings. Returns dict of
-    settings.
+    """Tries to contact DStat and get settings. Stores settings of default
+    connection in global settings var.
     """
     
     global settings
     settings = {}
-    
-    while serial_instance.data_pipe_p.poll():
-        serial_instance.data_pipe_p.recv()
-    
-    serial_instance.proc_pipe_p.send(Settings(task='r'))
-    settings = serial_instance.data_pipe_p.recv()
-    
-    logger.debug("read_settings: %s", serial_instance.proc_pipe_p.recv())
+    settings = serial_instance.read_settings()
     
     return
     
+def default_settings():
+    """Returns settings of default connection."""
+    return settings
+
 def write_settings():
     """Tries to write settings to DStat from global settings var.
     """
     
-    while serial_instance.data_pipe_p.poll():
-        serial_instance.data_pipe_p.recv()
-    
-    serial_instance.proc_pipe_p.send(Settings(task='w', settings=settings))
-    
-    logger.debug("write_settings: %s", serial_instance.proc_pipe_p.recv())
+    serial_instance.write_settings(settings)
     
     return
     
@@ -272,12 +696,11 @@ class LightSensor:
         light sensor clear channel.
         """
         
-        ser.flushInput()
-        ser.write('!')
-                
-        while not ser.read()=="C":
-            self.ser.flushInput()
-            ser.write('!')
+        try:
+            handshake(ser)
+        except HandshakeError as e:
+            logger.error('HandshakeError: %s', e)
+            return "SERIAL_ERROR"
             
         ser.write('T')
         for line in ser:
@@ -302,24 +725,201 @@ def read_light_sensor():
     light sensor clear channel.
     """
     
-    while serial_instance.data_pipe_p.poll():
-        serial_instance.data_pipe_p.recv()
-        
-    serial_instance.proc_pipe_p.send(LightSensor())
-    
-    logger.info("read_light_sensor: %s", serial_instance.proc_pipe_p.recv())
-    
-    return serial_instance.data_pipe_p.recv()
+    return serial_instance.read_light_sensor()
     
 
 class delayedSerial(serial.Serial): 
     """Extends Serial.write so that characters are output individually
-    with a slight delay
+    with a slight delay. Once VersionCheck has found firmware that supports
+    it, chunk_size is set and commands are written in chunks that fit the
+    firmware's receive buffer instead. Every command follows a '!'/'C'
+    handshake, so the buffer is empty when it starts. Each chunk is drained,
+    i.e. acknowledged by the device's USB stack, and given chunk_delay to be
+    parsed before the next one is sent.
     """
+    char_delay = .001
+    chunk_size = None
+    chunk_delay = .001
+
     def write(self, data):
-        for i in data:
-            serial.Serial.write(self, i)
-            time.sleep(.001)
+        if self.chunk_size:
+            for i in range(0, len(data), self.chunk_size):
+                if i:
+                    time.sleep(self.chunk_delay)
+                serial.Serial.write(self, data[i:i + self.chunk_size])
+                self.flush()
+        else:
+            for i in data:
+                serial.Serial.write(self, i)
+                time.sleep(self.char_delay)
+
+class FrameParser(object):
+    """Streaming decoder for DStat serial output. Pulls everything waiting
+    on the port in one read into a reusable buffer and splits it into
+    (kind, payload) frames:
+
+    ('B', data) -- binary sample record of databytes bytes
+    ('S', None) -- scan marker
+    ('#', line) -- log message from DStat
+    ('no', line) -- end of transmission
+    """
+    def __init__(self, databytes, chunk_size=65536):
+        """Arguments:
+        databytes -- length of binary record following each 'B' line
+        chunk_size -- maximum number of bytes pulled from port per read
+        """
+        self.databytes = databytes
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.pos = 0
+
+    def read(self, ser):
+        """Reads all bytes waiting on ser (blocking up to ser.timeout if
+        none are waiting) and returns a generator of complete frames.
+        """
+        waiting = ser.inWaiting()
+        self.feed(ser.read(min(max(waiting, 1), self.chunk_size)))
+        return self.frames()
+
+    def feed(self, data):
+        """Appends data to buffer, discarding already decoded bytes."""
+        if self.pos > self.chunk_size:
+            del self.buffer[:self.pos]
+            self.pos = 0
+        self.buffer.extend(data)
+
+    def frames(self):
+        """Yields complete frames from buffer. Incomplete lines and records
+        are kept until more data is fed.
+        """
+        buf = self.buffer
+
+        while True:
+            end = buf.find('\n', self.pos)
+            if end < 0:
+                return
+
+            if buf.startswith('B', self.pos):
+                stop = end + 1 + self.databytes
+                if stop > len(buf):
+                    return
+                self.pos = stop
+                yield ('B', bytes(buf[end + 1:stop]))
+                continue
+
+            line = str(buf[self.pos:end]).strip()
+            self.pos = end + 1
+
+            if line.startswith('S'):
+                yield ('S', None)
+            elif line.startswith('#'):
+                yield ('#', line)
+            elif line.startswith('no'):
+                del self.buffer[:]
+                self.pos = 0
+                yield ('no', line)
+                return
+
+class SampleBlocks(object):
+    """Collects decoded samples in the serial process and sends them through
+    a pipe as (scan, columns) blocks of contiguous arrays. A block is sent
+    once it holds block_size samples, interval seconds have passed since the
+    last block or a new scan starts.
+    """
+    def __init__(self, pipe, block_size=4096, interval=.05):
+        self.pipe = pipe
+        self.block_size = block_size
+        self.interval = interval
+        self.scan = 0
+        self.pending = []
+        self.pending_samples = 0
+        self.last_sent = time.time()
+
+    def add(self, scan, columns):
+        """Adds a tuple of column arrays belonging to scan."""
+        if self.pending and scan != self.scan:
+            self.flush()
+        self.scan = scan
+        self.pending.append(columns)
+        self.pending_samples += len(columns[0])
+
+        if self.pending_samples >= self.block_size:
+            self.flush()
+        else:
+            self.poll()
+
+    def poll(self):
+        """Sends pending samples if interval has passed."""
+        if time.time() - self.last_sent >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Sends all pending samples as one block."""
+        self.last_sent = time.time()
+        if not self.pending:
+            return
+
+        if len(self.pending) == 1:
+            columns = self.pending[0]
+        else:
+            columns = tuple(np.concatenate(i) for i in zip(*self.pending))
+        self.pipe.send((self.scan, columns))
+
+        self.pending = []
+        self.pending_samples = 0
+
+class _LocalStore(object):
+    """Pipe-like sink that stores blocks in an Experiment's own data."""
+    def __init__(self, experiment):
+        self.experiment = experiment
+
+    def send(self, block):
+        self.experiment.store_block(*block)
+
+class BatchResult(object):
+    """Outcome of one experiment in an ExperimentBatch.
+
+    Attributes:
+    index -- position of experiment in batch
+    status -- return code of Experiment.run, or "SKIPPED"
+    data -- Experiment.data, None if skipped
+    time -- datetime when experiment finished
+    """
+    def __init__(self, index, status, data=None):
+        self.index = index
+        self.status = status
+        self.data = data
+        self.time = datetime.now()
+
+class ExperimentBatch(object):
+    """Ordered batch of Experiment instances run back-to-back in the serial
+    process without returning to the GUI in between. A BatchResult is sent
+    through data_pipe as soon as each experiment finishes. If one
+    experiment doesn't finish with "DONE", the remaining ones are skipped.
+    """
+    def __init__(self, experiments):
+        self.experiments = list(experiments)
+
+    def run(self, ser, ctrl_pipe, data_pipe):
+        queue = deque(enumerate(self.experiments))
+        status = "DONE"
+
+        while queue:
+            index, experiment = queue.popleft()
+            experiment.collect_data = True
+            exp_logger.info("Batch: running experiment %s of %s", index + 1,
+                            len(self.experiments))
+            result = experiment.run(ser, ctrl_pipe, data_pipe)
+            data_pipe.send(BatchResult(index, result, experiment.data))
+
+            if result != "DONE":
+                status = result
+                break
+
+        for index, experiment in queue:
+            data_pipe.send(BatchResult(index, "SKIPPED"))
+
+        return status
 
 class SerialDevices(object):
     """Retrieves and stores list of serial devices in self.ports"""
@@ -338,9 +938,27 @@ class Experiment(object):
     """Store and acquire a potentiostat experiment. Meant to be subclassed
     to by different experiment types and not used instanced directly.
     """
+    # Layout of binary sample records, uint16 + int32
+    record_dtype = np.dtype([('voltage', '<u2'), ('current', '<i4')])
+    # Set by serial process if data should bypass data_pipe
+    ring_buffer = None
+    # If True, data is kept in self.data by the serial process (batches)
+    collect_data = False
+    # Samples lost because shared memory buffer was full
+    dropped_samples = 0
+    # Set by serial_handler if "DISCONNECT" aborted the experiment
+    disconnect_requested = False
 
-    def __init__(self, parameters):
-        """Adds commands for gain and ADC."""
+    def __init__(self, parameters, settings=None):
+        """Adds commands for gain and ADC.
+
+        Arguments:
+        parameters -- dict of experiment parameters
+        settings -- settings of DStat used for gain trim, defaults to
+            settings of default connection
+        """
+        if settings is None:
+            settings = default_settings()
         self.parameters = parameters
         self.databytes = 8
         self.scan = 0
@@ -348,9 +966,8 @@ class Experiment(object):
         self.plots = {}
         self.data = {}
         
-        # list of scans, tuple of dimensions, list of data
-        self.data['data'] = [([], [])]
-        self.line_data = ([], [])
+        # list of scans, tuple of dimensions, array of data
+        self.data['data'] = ScanStore(2, self.expected_samples())
         
         major, minor = self.parameters['version']
         
@@ -401,21 +1018,27 @@ class Experiment(object):
             status = "DONE"
             
             for i in self.commands:
-                logger.info("Command: %s", i)
-                self.serial.flushInput()
-                self.serial.write('!')
-                
-                while not self.serial.read()=="C":
-                    self.serial.flushInput()
-                    self.serial.write('!')
-    
+                handshake(self.serial)
+
+                start = time.time()
                 self.serial.write(i)
+                latency = time.time() - start
+                command_latency.add(latency)
+                logger.info("Command: %s -- sent in %.2f ms", i,
+                            latency * 1000)
                 if not self.serial_handler():
-                    status = "ABORT"
+                    if self.disconnect_requested:
+                        status = "DISCONNECT"
+                    else:
+                        status = "ABORT"
+                    break
             
             self.data_postprocessing()
         except serial.SerialException:
             status = "SERIAL_ERROR"
+        except HandshakeError as e:
+            exp_logger.error('HandshakeError: %s', e)
+            status = "SERIAL_ERROR"
         finally:
             while self.ctrl_pipe.poll():
                 self.ctrl_pipe.recv()
@@ -423,47 +1046,92 @@ class Experiment(object):
     
     def serial_handler(self):
         """Handles incoming serial transmissions from DStat. Returns False
-        if stop button pressed and sends abort signal to instrument. Sends
-        data to self.data_pipe as result of self.data_handler).
+        if stop button pressed or serial connection is closed and sends abort
+        signal to instrument. Sends data to self.data_pipe as result of
+        self.data_handler).
         """
         scan = 0
+        parser = FrameParser(self.databytes)
+        if self.collect_data:
+            self.blocks = SampleBlocks(_LocalStore(self), block_size=1)
+        elif self.ring_buffer is not None:
+            self.blocks = SampleBlocks(self.ring_buffer, block_size=1)
+        else:
+            self.blocks = SampleBlocks(self.data_pipe)
         try:
             while True:
                 if self.ctrl_pipe.poll():
                     input = self.ctrl_pipe.recv()
                     logger.debug("serial_handler: %s", input)
-                    if input == ('a' or "DISCONNECT"):
+                    if input in ('a', "DISCONNECT"):
                         self.serial.write('a')
                         logger.info("serial_handler: ABORT pressed!")
+                        self.disconnect_requested = input == "DISCONNECT"
                         return False
-                            
-                for line in self.serial:
-                    if self.ctrl_pipe.poll():
-                        if self.ctrl_pipe.recv() == 'a':
-                            self.serial.write('a')
-                            logger.info("serial_handler: ABORT pressed!")
-                            return False
-                            
-                    if line.startswith('B'):
-                        data = self.data_handler(
-                                (scan, self.serial.read(size=self.databytes)))
-                        self.data_pipe.send(data)
-                        
-                    elif line.lstrip().startswith('S'):
+
+                records = []
+                for kind, payload in parser.read(self.serial):
+                    if kind == 'B':
+                        records.append(payload)
+                        continue
+
+                    if records:
+                        self.block_handler(scan, ''.join(records))
+                        records = []
+
+                    if kind == 'S':
                         scan += 1
-                        
-                    elif line.lstrip().startswith("#"):
-                        dstat_logger.info(line.lstrip().rstrip())
-                                        
-                    elif line.lstrip().startswith("no"):
-                        dstat_logger.debug(line.lstrip().rstrip())
+
+                    elif kind == '#':
+                        dstat_logger.info(payload)
+
+                    elif kind == 'no':
+                        dstat_logger.debug(payload)
                         self.serial.flushInput()
                         return True
-                        
+
+                if records:
+                    self.block_handler(scan, ''.join(records))
+                self.blocks.poll()
+
         except serial.SerialException:
             return False
-    
-    
+
+        finally:
+            self.blocks.flush()
+
+    def block_handler(self, scan, data):
+        """Handles a block of consecutive binary sample records from one
+        scan. Decodes them with self.batch_data_handler and queues them to
+        be sent to self.data_pipe by default.
+        """
+        self.blocks.add(*self.batch_data_handler((scan, data)))
+
+    def store_block(self, scan, columns):
+        """Appends a (scan, columns) block received from the serial process
+        to self.data['data']. Called in the GUI process.
+        """
+        self.data['data'].extend(scan, columns)
+
+    def expected_samples(self):
+        """Returns estimated number of samples per scan, 0 if unknown."""
+        return 0
+
+    def _sample_rate(self):
+        """Returns ADC sample rate in Hz, 0 if unknown."""
+        return float(self.parameters.get('adc_rate_hz', 0))
+
+    def _sweep_samples(self, sweep_mV):
+        """Returns estimated samples for a sweep of sweep_mV: one per DAC
+        step, or fewer if the ADC samples less often than that.
+        """
+        steps = int(abs(sweep_mV) * 65536. / 3000)
+        if not int(self.parameters['slope']) or not self._sample_rate():
+            return steps
+        return min(steps, int(abs(sweep_mV) /
+                              float(self.parameters['slope']) *
+                              self._sample_rate()))
+
     def data_handler(self, data_input):
         """Takes data_input as tuple -- (scan, data).
         Returns:
@@ -476,6 +1144,22 @@ class Experiment(object):
                        (current+self.gain_trim)*(1.5/self.gain/8388607)
                        )
                )
+
+    def batch_data_handler(self, data_input):
+        """Vectorized data_handler. Takes data_input as tuple --
+        (scan, data) where data holds any number of records.
+        Returns:
+        (scan number, (voltage, current)) -- arrays, voltage in mV, current
+        in A. Output is identical to calling data_handler on each record.
+        """
+        scan, data = data_input
+        records = np.frombuffer(data, dtype=self.record_dtype)
+        current = records['current'].astype(np.int64)
+        return (scan, (
+                       (records['voltage']-32768.)*3000./65536,
+                       (current+self.gain_trim)*(1.5/self.gain/8388607)
+                       )
+               )
     
     def data_postprocessing(self):
         """No data postprocessing done by default, can be overridden
@@ -492,14 +1176,26 @@ class Experiment(object):
                   "xmin" : self.xmin,
                   "xmax" : self.xmax,
                   "parameters" : self.parameters,
-                  "data" : self.data,
-                  "commands" : self.commands
+                  "data" : self._export_data(),
+                  "commands" : self.commands,
+                  "analysis" : getattr(self, 'analysis', {}),
+                  "dropped_samples" : self.dropped_samples
                   }
         
         return output
 
+    def _export_data(self):
+        """Returns copy of self.data with scans as arrays."""
+        data = dict(self.data)
+        data['data'] = self.data['data'].arrays()
+        return data
+
 class CALExp(Experiment):
     """Offset calibration experiment"""
+    # 2*uint16 + int32
+    record_dtype = np.dtype([('seconds', '<u2'), ('milliseconds', '<u2'),
+                             ('current', '<i4')])
+
     def __init__(self, parameters):
         self.parameters = parameters
         self.databytes = 8
@@ -516,44 +1212,10 @@ class CALExp(Experiment):
         self.commands[2] += " "
         self.commands[2] += "0 " # disable photodiode interlock
         
-    def serial_handler(self):
-        """Handles incoming serial transmissions from DStat. Returns False
-        if stop button pressed and sends abort signal to instrument. Sends
-        data to self.data_pipe as result of self.data_handler).
-        """
+    def block_handler(self, scan, data):
+        """Overrides Experiment method to keep samples for averaging."""
+        self.data.extend(self.batch_data_handler(data).tolist())
 
-        try:
-            while True:
-                if self.ctrl_pipe.poll():
-                    input = self.ctrl_pipe.recv()
-                    logger.debug("serial_handler: %s", input)
-                    if input == ('a' or "DISCONNECT"):
-                        self.serial.write('a')
-                        logger.info("serial_handler: ABORT pressed!")
-                        return False
-                        
-                for line in self.serial:                    
-                    if self.ctrl_pipe.poll():
-                        if self.ctrl_pipe.recv() == 'a':
-                            self.serial.write('a')
-                            logger.info("serial_handler: ABORT pressed!")
-                            return False
-                            
-                    if line.startswith('B'):
-                        self.data.append(self.data_handler(
-                                        self.serial.read(size=self.databytes)))
-                        
-                    elif line.lstrip().startswith("#"):
-                        dstat_logger.info(line.lstrip().rstrip())
-                        
-                    elif line.lstrip().startswith("no"):
-                        dstat_logger.debug(line.lstrip().rstrip())
-                        self.serial.flushInput()
-                        return True
-                        
-        except serial.SerialException:
-            return False
-            
     def data_handler(self, data):
         """Takes data_input as tuple -- (scan, data).
         Returns:
@@ -562,6 +1224,10 @@ class CALExp(Experiment):
         
         seconds, milliseconds, current = struct.unpack('<HHl', data)
         return current
+
+    def batch_data_handler(self, data):
+        """Vectorized data_handler. Returns array of currents."""
+        return np.frombuffer(data, dtype=self.record_dtype)['current']
     
     def data_postprocessing(self):
         """Averages data points
@@ -584,8 +1250,12 @@ class CALExp(Experiment):
 
 class Chronoamp(Experiment):
     """Chronoamperometry experiment"""
-    def __init__(self, parameters):
-        super(Chronoamp, self).__init__(parameters)
+    # 2*uint16 + int32
+    record_dtype = np.dtype([('seconds', '<u2'), ('milliseconds', '<u2'),
+                             ('current', '<i4')])
+
+    def __init__(self, parameters, settings=None):
+        super(Chronoamp, self).__init__(parameters, settings)
 
         self.datatype = "linearData"
         self.xlabel = "Time (s)"
@@ -609,6 +1279,10 @@ class Chronoamp(Experiment):
             self.commands[2] += str(i)
             self.commands[2] += " "
         self.commands[2] += "0 " # disable photodiode interlock
+
+    def expected_samples(self):
+        return int(sum(int(i) for i in self.parameters['time']) *
+                   self._sample_rate())
             
     def data_handler(self, data_input):
         """Overrides Experiment method to not convert x axis to mV."""
@@ -621,10 +1295,21 @@ class Chronoamp(Experiment):
                        )
                 )
 
+    def batch_data_handler(self, data_input):
+        """Overrides Experiment method to not convert x axis to mV."""
+        scan, data = data_input
+        records = np.frombuffer(data, dtype=self.record_dtype)
+        current = records['current'].astype(np.int64)
+        return (scan, (
+                       records['seconds']+records['milliseconds']/1000.,
+                       (current+self.gain_trim)*(1.5/self.gain/8388607)
+                       )
+                )
+
 class PDExp(Chronoamp):
     """Photodiode/PMT experiment"""
-    def __init__(self, parameters):
-        super(Chronoamp, self).__init__(parameters) # Don't want to call CA's init
+    def __init__(self, parameters, settings=None):
+        super(Chronoamp, self).__init__(parameters, settings) # Don't want to call CA's init
 
         self.datatype = "linearData"
         self.xlabel = "Time (s)"
@@ -664,10 +1349,17 @@ class PDExp(Chronoamp):
             else:
                 self.commands.append("E1")
 
+    def expected_samples(self):
+        return int(int(self.parameters['time']) * self._sample_rate())
+
 class PotExp(Experiment):
     """Potentiometry experiment"""
-    def __init__(self, parameters):
-        super(PotExp, self).__init__(parameters)
+    # 2*uint16 + int32
+    record_dtype = np.dtype([('seconds', '<u2'), ('milliseconds', '<u2'),
+                             ('voltage', '<i4')])
+
+    def __init__(self, parameters, settings=None):
+        super(PotExp, self).__init__(parameters, settings)
 
         self.datatype = "linearData"
         self.xlabel = "Time (s)"
@@ -682,6 +1374,9 @@ class PotExp(Experiment):
         self.commands[2] += str(self.parameters['time'])
         self.commands[2] += " 1 " #potentiometry mode
 
+    def expected_samples(self):
+        return int(int(self.parameters['time']) * self._sample_rate())
+
     def data_handler(self, data_input):
         """Overrides Experiment method to not convert x axis to mV."""
         scan, data = data_input
@@ -692,10 +1387,20 @@ class PotExp(Experiment):
                        )
                 )
 
+    def batch_data_handler(self, data_input):
+        """Overrides Experiment method to not convert x axis to mV."""
+        scan, data = data_input
+        records = np.frombuffer(data, dtype=self.record_dtype)
+        return (scan, (
+                       records['seconds']+records['milliseconds']/1000.,
+                       records['voltage']*(1.5/8388607.)
+                       )
+                )
+
 class LSVExp(Experiment):
     """Linear Scan Voltammetry experiment"""
-    def __init__(self, parameters):
-        super(LSVExp, self).__init__(parameters)
+    def __init__(self, parameters, settings=None):
+        super(LSVExp, self).__init__(parameters, settings)
 
         self.datatype = "linearData"
         self.xlabel = "Voltage (mV)"
@@ -724,10 +1429,14 @@ class LSVExp(Experiment):
         self.commands[2] += str(self.parameters['slope'])
         self.commands[2] += " "
 
+    def expected_samples(self):
+        return self._sweep_samples(int(self.parameters['stop']) -
+                                   int(self.parameters['start']))
+
 class CVExp(Experiment):
     """Cyclic Voltammetry experiment"""
-    def __init__(self, parameters):
-        super(CVExp, self).__init__(parameters)
+    def __init__(self, parameters, settings=None):
+        super(CVExp, self).__init__(parameters, settings)
  
         self.datatype = "CVData"
         self.xlabel = "Voltage (mV)"
@@ -760,16 +1469,24 @@ class CVExp(Experiment):
         self.commands[2] += str(self.parameters['slope'])
         self.commands[2] += " "
 
+    def expected_samples(self):
+        return self._sweep_samples(2 * (int(self.parameters['v2']) -
+                                        int(self.parameters['v1'])))
+
 class SWVExp(Experiment):
     """Square Wave Voltammetry experiment"""
-    def __init__(self, parameters):
-        super(SWVExp, self).__init__(parameters)
+    # uint16 + 2*int32
+    record_dtype = np.dtype([('voltage', '<u2'), ('forward', '<i4'),
+                             ('reverse', '<i4')])
+
+    def __init__(self, parameters, settings=None):
+        super(SWVExp, self).__init__(parameters, settings)
 
         self.datatype = "SWVData"
         self.xlabel = "Voltage (mV)"
         self.ylabel = "Current (A)"
-        self.data['data'] = [([], [], [], [])]  # voltage, current, forwards, reverse
-        self.line_data = ([], [], [], [])
+        # voltage, current, forwards, reverse
+        self.data['data'] = ScanStore(4, self.expected_samples())
         self.datalength = 2 * self.parameters['scans']
         self.databytes = 10
         
@@ -800,6 +1517,12 @@ class SWVExp(Experiment):
         self.commands[2] += " "
         self.commands[2] += str(self.parameters['scans'])
         self.commands[2] += " "
+
+    def expected_samples(self):
+        if not int(self.parameters['step']):
+            return 0
+        return abs(int(self.parameters['stop']) -
+                   int(self.parameters['start'])) // int(self.parameters['step'])
     
     def data_handler(self, input_data):
         """Overrides Experiment method to calculate difference current"""
@@ -817,18 +1540,33 @@ class SWVExp(Experiment):
                        )
                 )
 
+    def batch_data_handler(self, data_input):
+        """Overrides Experiment method to calculate difference current"""
+        scan, data = data_input
+        records = np.frombuffer(data, dtype=self.record_dtype)
+        f_trim = records['forward'].astype(np.int64)+self.gain_trim
+        r_trim = records['reverse'].astype(np.int64)+self.gain_trim
+
+        return (scan, (
+                       (records['voltage']-32768.)*3000./65536,
+                       (f_trim-r_trim)*(1.5/self.gain/8388607),
+                       f_trim*(1.5/self.gain/8388607),
+                       r_trim*(1.5/self.gain/8388607)
+                       )
+                )
+
 
 class DPVExp(SWVExp):
     """Diffential Pulse Voltammetry experiment."""
-    def __init__(self, parameters):
+    def __init__(self, parameters, settings=None):
         """Overrides SWVExp method, extends Experiment method"""
-        super(SWVExp, self).__init__(parameters)
+        super(SWVExp, self).__init__(parameters, settings)
         
         self.datatype = "SWVData"
         self.xlabel = "Voltage (mV)"
         self.ylabel = "Current (A)"
-        self.data['data'] = [([], [], [], [])]  # voltage, current, forwards, reverse
-        self.line_data = ([], [], [], [])
+        # voltage, current, forwards, reverse
+        self.data['data'] = ScanStore(4, self.expected_samples())
         self.datalength = 2
         self.databytes = 10
         
@@ -862,6 +1600,10 @@ class DPVExp(SWVExp):
 
 class OCPExp(Experiment):
     """Open circuit potential measumement in statusbar."""
+    # 2*uint16 + int32
+    record_dtype = np.dtype([('seconds', '<u2'), ('milliseconds', '<u2'),
+                             ('voltage', '<i4')])
+
     def __init__(self):
         self.databytes = 8
         
@@ -880,6 +1622,17 @@ class OCPExp(Experiment):
         # 2*uint16 + int32
         seconds, milliseconds, voltage = struct.unpack('<HHl', data)
         return (voltage/5.592405e6)
+
+    def batch_data_handler(self, data_input):
+        """Overrides Experiment method to only return ADC values."""
+        scan, data = data_input
+        records = np.frombuffer(data, dtype=self.record_dtype)
+        return records['voltage']/5.592405e6
+
+    def block_handler(self, scan, data):
+        """Overrides Experiment method to send bare OCP values."""
+        for voltage in self.batch_data_handler((scan, data)).tolist():
+            self.data_pipe.send(voltage)
         
 class PMTIdle(Experiment):
     """Open circuit potential measumement in statusbar."""
@@ -893,18 +1646,4 @@ class PMTIdle(Experiment):
         self.commands[0] += "1 " # 2x PGA
         
 def measure_offset(time):
-    gain_trim_table = [None, 'r100_trim', 'r3k_trim', 'r30k_trim', 'r300k_trim',
-                        'r3M_trim', 'r30M_trim', 'r100M_trim']
-    
-    parameters = {}
-    parameters['time'] = time
-    
-    gain_offset = {}
-    
-    for i in range(1,8):
-        parameters['gain'] = i
-        serial_instance.proc_pipe_p.send(CALExp(parameters))
-        logger.info("measure_offset: %s", serial_instance.proc_pipe_p.recv())
-        gain_offset[gain_trim_table[i]] = serial_instance.data_pipe_p.recv()
-        
-    return gain_offset
\ No newline at end of file
+    return serial_instance.measure_offset(time)
@@ -46,6 +46,22 @@ class VarError(Error):
         self.var = var
         self.msg = msg
 
+class HandshakeError(Error):
+    """Exception raised when DStat does not answer a handshake. Extends Error
+    class.
+        
+    Attributes:
+        attempts -- number of handshakes attempted
+        msg  -- error message
+    """
+    
+    def __init__(self, attempts, msg):
+        self.attempts = attempts
+        self.msg = msg
+
+    def __str__(self):
+        return "%s (%s attempts)" % (self.msg, self.attempts)
+
 class ErrorLogger(object):
     def __init__(self, sender="dstat-interface-mrbox", level=('ERR', 'WAR', 'INFO')):
         self.sender = str(sender)
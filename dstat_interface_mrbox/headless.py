@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Headless acquisition for Wheeler Lab DStat
+
+Runs experiments described by parameter files written by
+:func:`params.save_params` without GTK, e.g.::
+
+    python -m dstat_interface_mrbox.headless /dev/ttyACM0 cv.yml -o data/cv
+
+Attributes
+----------
+EXPERIMENT_CLASSES : dict
+    Mapping of ``experiment_index`` parameter values to experiment class
+    and parameter test function.
+'''
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import uuid
+
+# Add package directory to Python path.
+#
+# This is required for relative imports, which are required for running under a
+# `multiprocessing` process.
+parent_dir = os.path.abspath(os.path.dirname(__file__))
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+import dstat_comm as comm
+import params
+import parameter_test
+import analysis
+import interface.save as save
+from errors import InputError
+
+logger = logging.getLogger("dstat.headless")
+
+EXPERIMENT_CLASSES = {'cae': (comm.Chronoamp, None),
+                      'lsv': (comm.LSVExp, parameter_test.lsv_test),
+                      'cve': (comm.CVExp, parameter_test.cv_test),
+                      'swv': (comm.SWVExp, parameter_test.swv_test),
+                      'dpv': (comm.DPVExp, parameter_test.dpv_test),
+                      'pde': (comm.PDExp, parameter_test.pd_test),
+                      'pot': (comm.PotExp, parameter_test.pot_test)}
+
+
+class AcquisitionSession(object):
+    '''
+    Connection to a DStat for running experiments without GTK.
+
+    Parameters
+    ----------
+    ser_port : str
+        Address of serial port DStat is connected to.
+    db_path : str, optional
+        Data directory of database.  If given, results are added to the
+        database.
+    '''
+    def __init__(self, ser_port, db_path=None):
+        self.ser_port = ser_port
+        # Return code of last run
+        self.status = None
+        self.devices = comm.DeviceManager()
+        self.connection = self.devices.connect(ser_port)
+        self.version = self.connection.version
+        logger.info("DStat version: %s.%s", *self.version)
+
+        self.db = None
+        if db_path is not None:
+            import db
+            db.start_db(path=db_path)
+            self.db = db.current_db
+
+    def close(self):
+        '''
+        Disconnect from DStat and database.
+        '''
+        self.devices.disconnect()
+        if self.db is not None:
+            import db
+            db.stop_db()
+            self.db = None
+
+    def build_experiment(self, parameters):
+        '''
+        Check parameters and create experiment.
+
+        Parameters
+        ----------
+        parameters : dict
+            Parameters in format written by :func:`params.save_params`.
+
+        Returns
+        -------
+        dstat_comm.Experiment
+            Experiment using version and gain trim settings of connected
+            DStat.
+        '''
+        parameters = dict(parameters)
+        # Make sure these are defined
+        parameters.setdefault('metadata', None)
+        parameters.setdefault('sync_true', False)
+        parameters.setdefault('shutter_true', False)
+
+        experiment_index = parameters.get('experiment_index')
+        if experiment_index not in EXPERIMENT_CLASSES:
+            raise InputError(experiment_index,
+                             "Experiment not yet implemented.")
+        experiment_class, test = EXPERIMENT_CLASSES[experiment_index]
+
+        if experiment_index == 'cae' and not parameters['potential']:
+            raise InputError(parameters['potential'], "Step table is empty")
+        if experiment_index == 'pot' and not (self.version[0] >= 1 and
+                                              self.version[1] >= 2):
+            raise InputError(self.version,
+                             "v1.1 board does not support potentiometry.")
+        if test is not None:
+            test(parameters)
+
+        return self.connection.new_experiment(experiment_class, parameters)
+
+    def run(self, parameter_list, metadata=None):
+        '''
+        Run experiments back-to-back.
+
+        Parameters
+        ----------
+        parameter_list : list
+            Parameter dicts, one per experiment.
+        metadata : dict, optional
+            External metadata stored with results in database.
+
+        Returns
+        -------
+        list
+            ``(measurement_id, experiment)`` for each experiment that
+            finished with ``"DONE"``.  Analysis results are in
+            ``experiment.analysis``.  Return code of the batch is stored in
+            :attr:`status`.
+        '''
+        experiments = []
+        for parameters in parameter_list:
+            parameters = dict(parameters, metadata=metadata)
+            experiments.append((uuid.uuid4(),
+                                self.build_experiment(parameters)))
+
+        self.devices.start({self.ser_port: [i[1] for i in experiments]})
+        try:
+            status, results = self.devices.collect()[self.ser_port]
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, aborting experiment")
+            self.devices.abort()
+            status, results = self.devices.collect()[self.ser_port]
+        logger.info("Return code: %s", status)
+        self.status = status
+
+        finished = []
+        for result in results:
+            measurement_id, experiment = experiments[result.index]
+            if result.status == "SKIPPED":
+                logger.info("Skipped experiment %s", measurement_id.hex)
+                continue
+            elif result.status != "DONE":
+                logger.error("Experiment %s failed: %s", measurement_id.hex,
+                             result.status)
+                continue
+
+            experiment.data = result.data
+            experiment.time = result.time
+            analysis.do_analysis(experiment)
+            finished.append((measurement_id, experiment))
+
+        return finished
+
+    def save(self, measurement_id, experiment, path=None,
+             experiment_id=None, patient_id=None, name=None):
+        '''
+        Write experiment results to text files and/or database.
+
+        Parameters
+        ----------
+        measurement_id : uuid.UUID
+            Identifier of measurement.
+        experiment : dstat_comm.Experiment
+            Finished experiment returned by :meth:`run`.
+        path : str, optional
+            Path passed to :func:`interface.save.save_text`.
+        experiment_id, patient_id, name : str, optional
+            Database fields of measurement.
+
+        Returns
+        -------
+        str or None
+            Name of measurement in database.
+        '''
+        if path is not None:
+            save.save_text(experiment, path)
+
+        if self.db is None:
+            return None
+
+        meta = {}
+        metadata = experiment.parameters['metadata']
+        if metadata is not None:
+            exp_metakeys = ['experiment_uuid', 'patient_id', 'name']
+            meta.update({k: metadata[k] for k in metadata
+                         if k not in exp_metakeys})
+
+        return self.db.add_results(measurement_uuid=measurement_id.hex,
+                                   measurement_name=name,
+                                   experiment_uuid=experiment_id,
+                                   experiment_metadata=meta,
+                                   patient_id=patient_id,
+                                   timestamp=None,
+                                   data=experiment.export())
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Run DStat experiments '
+                                     'without the GUI.')
+    parser.add_argument('port', help='Serial port of DStat.')
+    parser.add_argument('params', nargs='+', help='Parameter files (.yml) '
+                        'saved from the GUI. Experiments are run back-to-back '
+                        'in the order given.')
+    parser.add_argument('-o', '--output', help='Output path for text files. '
+                        'Defaults to name of parameter file. With several '
+                        'parameter files, the name of each one is added.')
+    parser.add_argument('--db', metavar='DATA_DIR', help='Add results to '
+                        'database in DATA_DIR.')
+    parser.add_argument('--experiment-id', help='Database experiment id. '
+                        'Autogenerated if not given.')
+    parser.add_argument('--patient-id', help='Database patient id.')
+    parser.add_argument('--name', help='Database measurement name.')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    multiprocessing.freeze_support()
+
+    root_logger = logging.getLogger("dstat")
+    root_logger.setLevel(level=logging.INFO)
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter(
+        fmt='%(asctime)s [%(name)s](%(levelname)s) %(message)s',
+        datefmt='%H:%M:%S'))
+    root_logger.addHandler(log_handler)
+
+    args = parse_args(args)
+    parameter_list = [params.read_params(path) for path in args.params]
+
+    experiment_id = args.experiment_id
+    if args.db is not None and experiment_id is None:
+        experiment_id = uuid.uuid4().hex
+
+    session = AcquisitionSession(args.port, db_path=args.db)
+    try:
+        finished = session.run(parameter_list)
+        # Experiments after a failed one are skipped, so finished
+        # experiments are in the same order as the parameter files.
+        for index, (measurement_id, experiment) in enumerate(finished):
+            stem = os.path.splitext(args.params[index])[0]
+            if args.output is None:
+                path = stem
+            elif len(args.params) == 1:
+                path = args.output
+            else:
+                name, ext = os.path.splitext(args.output)
+                path = "%s-%s-%s%s" % (name, index,
+                                       os.path.basename(stem), ext)
+            session.save(measurement_id, experiment, path=path,
+                         experiment_id=experiment_id,
+                         patient_id=args.patient_id, name=args.name)
+            logger.info("Saved measurement %s", measurement_id.hex)
+    finally:
+        session.close()
+
+    if session.status != "DONE" or len(finished) != len(parameter_list):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,9 +23,11 @@ import sys
 import gtk
 import gobject
 
+from serial import SerialException
+
 import dstat_comm
 import __main__
-from errors import InputError, VarError, ErrorLogger
+from errors import InputError, VarError, ErrorLogger, HandshakeError
 _logger = ErrorLogger(sender="dstat-interface-mrbox-exp_int")
 
 class ExpInterface(object):
@@ -320,6 +322,9 @@ class PD(ExpInterface):
                                     dstat_comm.settings['tcs_clear_threshold'][1]))   
             __main__.MAIN.start_ocp()
             
+        except (SerialException, HandshakeError) as e:
+            _serial_error(e)
+
         finally:
             gobject.timeout_add(700, restore_buttons, self.buttons)
         
@@ -339,6 +344,9 @@ class PD(ExpInterface):
                                 str(dstat_comm.settings['tcs_clear_threshold'][1]))   
             __main__.MAIN.start_ocp()
         
+        except (SerialException, HandshakeError) as e:
+            _serial_error(e)
+
         finally:
             gobject.timeout_add(700, restore_buttons, self.buttons)
             
@@ -404,6 +412,9 @@ class CAL(ExpInterface):
     
             __main__.MAIN.start_ocp()
             
+        except (SerialException, HandshakeError) as e:
+            _serial_error(e)
+
         finally:
             gobject.timeout_add(700, restore_buttons, self.buttons)
         
@@ -426,6 +437,9 @@ class CAL(ExpInterface):
                                 
             __main__.MAIN.start_ocp()
             
+        except (SerialException, HandshakeError) as e:
+            _serial_error(e)
+
         finally:
             gobject.timeout_add(700, restore_buttons, self.buttons)
                 
@@ -463,10 +477,20 @@ class CAL(ExpInterface):
                 dstat_comm.settings['r100M_trim'][1]))
             __main__.MAIN.start_ocp()
         
+        except (SerialException, HandshakeError) as e:
+            _serial_error(e)
+
         finally:
             gobject.timeout_add(700, restore_buttons, self.buttons)
             __main__.MAIN.spinner.stop()
 
+def _serial_error(err):
+    """Logs error communicating with DStat and shows it in status bar."""
+    _logger.error("%s: %s" % (type(err).__name__, err), "ERR")
+    __main__.MAIN.statusbar.remove_all(__main__.MAIN.error_context_id)
+    __main__.MAIN.statusbar.push(__main__.MAIN.error_context_id,
+                                 "Could not communicate with DStat.")
+
 def restore_buttons(buttons):
     """ Should be called with gobject callback """
     for i in buttons:
@@ -20,15 +20,28 @@
 
 import io
 import os
+import struct
+import zipfile
 
-import gtk
 import numpy as np
 import logging
+import yaml
 
 logger = logging.getLogger("dstat.interface.save")
 
+# Buckets per screen pixel when decimating plots for saving
+SAVE_RESOLUTION = 4
+# Rows formatted at a time when writing text files
+TEXT_CHUNK_SIZE = 2 ** 16
+
+try:
+    import gtk
+except ImportError: # Only dialogs need GTK, allow headless use
+    gtk = None
+
 from errors import InputError, VarError
 from params import save_params, load_params
+from scan_store import ScanStore
 
 def manSave(current_exp):
     fcd = gtk.FileChooserDialog("Save...", None, gtk.FILE_CHOOSER_ACTION_SAVE,
@@ -38,6 +51,9 @@ def manSave(current_exp):
     filters = [gtk.FileFilter()]
     filters[0].set_name("Space separated text (.txt)")
     filters[0].add_pattern("*.txt")
+    filters.append(gtk.FileFilter())
+    filters[1].set_name("NumPy archive (.npz)")
+    filters[1].add_pattern("*.npz")
 
     fcd.set_do_overwrite_confirmation(True)
     for i in filters:
@@ -52,6 +68,11 @@ def manSave(current_exp):
 
         if filter_selection.endswith("(.txt)"):
             save_text(current_exp, path)
+
+        elif filter_selection.endswith("(.npz)"):
+            if not path.endswith(".npz"):
+                path += ".npz"
+            save_npz(current_exp, path)
             
         fcd.destroy()
 
@@ -167,7 +188,7 @@ def autoSave(exp, path, name):
      
     save_text(exp, path)
 
-def autoPlot(exp, path, name):
+def autoPlot(exp, path, name, figures=None):
     if name == "":
         name = "file"
         
@@ -177,7 +198,38 @@ def autoPlot(exp, path, name):
     if not (path.endswith(".pdf") or path.endswith(".png")):
         path += ".pdf"
 
-    save_plot(exp, path)
+    save_plot(exp, path, figures)
+
+def iter_rows(scans, as_float=False, chunk_size=TEXT_CHUNK_SIZE):
+    """Yields blocks of text rows for data given as list of scans of columns.
+    Columns are placed side by side in scan order, each value followed by
+    five spaces, and each row ends in a newline. Rows past the end of
+    shorter columns leave them out.
+
+    Arguments:
+    as_float -- format values as Python floats, as for ScanStore data
+    chunk_size -- number of rows in each block
+    """
+    columns = [column for scan in scans for column in scan]
+    lengths = [len(column) for column in columns]
+    start = 0
+
+    # Rows between consecutive column lengths have the same columns
+    for stop in sorted(set(lengths)):
+        if stop == 0:
+            continue
+        active = [column for column, length in zip(columns, lengths)
+                  if length >= stop]
+        row_format = "%s     " * len(active) + "\n"
+
+        for first in xrange(start, stop, chunk_size):
+            last = min(first + chunk_size, stop)
+            chunk = [column[first:last] for column in active]
+            if as_float:
+                chunk = [np.asarray(column).tolist() for column in chunk]
+            yield "".join([row_format % values for values in zip(*chunk)])
+
+        start = stop
 
 def save_text(exp, path):
     name, _sep, ext = path.rpartition('.') # ('','',string) if no match
@@ -221,25 +273,114 @@ def save_text(exp, path):
             file.write("%s\n" % i)
       
         # Write out actual data  
-        line_buffer = []
-    
-        for scan in zip(*exp.data[dname]):
-            for dimension in scan:
-                for i in range(len(dimension)):
-                    try:
-                        line_buffer[i] += "%s     " % dimension[i]
-                    except IndexError:
-                        line_buffer.append("")
-                        line_buffer[i] += "%s     " % dimension[i]
-            
-        for i in line_buffer:
-            file.write("%s\n" % i)
+        data = exp.data[dname]
+        # Format ScanStore data as Python floats
+        for block in iter_rows(zip(*data),
+                               as_float=isinstance(data, ScanStore)):
+            file.write(block)
 
         file.close()
         
-def save_plot(exp, path):
+def _builtin(value):
+    """Returns value with numpy types replaced by Python types for YAML."""
+    if isinstance(value, dict):
+        return {k: _builtin(v) for k, v in value.iteritems()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_builtin(i) for i in value)
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+def save_npz(exp, path):
+    """Saves experiment to a NumPy .npz archive. Each scan of each entry in
+    exp.data is stored uncompressed as a 2D array (columns x samples) named
+    "<entry>/<scan>" so it can be memory-mapped by load_npz. Everything else
+    in exp.export(), plus acquisition time, is stored as YAML in
+    member metadata.yml.
+    """
+    output = exp.export()
+    arrays = {}
+
+    for dname, scans in output.pop('data').iteritems():
+        for number, scan in enumerate(scans):
+            arrays["%s/%s" % (dname, number)] = np.vstack(scan)
+
+    output['time'] = getattr(exp, 'time', None)
+
+    np.savez(path, **arrays)
+    archive = zipfile.ZipFile(path, 'a', allowZip64=True)
+    try:
+        archive.writestr('metadata.yml', yaml.dump(_builtin(output)))
+    finally:
+        archive.close()
+
+def _mmap_member(path, archive, name, mmap_mode):
+    """Returns memory-mapped array of uncompressed .npy member of a zip."""
+    info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise InputError(name, "Compressed array can't be memory-mapped.")
+
+    with open(path, 'rb') as f:
+        # Local header is followed by variable length name and extra fields
+        f.seek(info.header_offset)
+        header = f.read(zipfile.sizeFileHeader)
+        name_length, extra_length = struct.unpack('<HH', header[-4:])
+        f.seek(info.header_offset + zipfile.sizeFileHeader +
+               name_length + extra_length)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return np.memmap(path, dtype=dtype, mode=mmap_mode, offset=offset,
+                     shape=shape, order='F' if fortran_order else 'C')
+
+def load_npz(path, mmap_mode='r'):
+    """Loads experiment saved by save_npz.
+
+    Arguments:
+    path -- path of .npz file
+    mmap_mode -- mode to memory-map arrays with (see numpy.memmap), or None
+        to read them into memory
+
+    Returns:
+    dict in the format of Experiment.export() with additional key 'time'.
+    Scans in 'data' are tuples of column arrays.
+    """
+    archive = zipfile.ZipFile(path, 'r')
+    try:
+        output = yaml.load(archive.read('metadata.yml'))
+
+        members = {}
+        for name in archive.namelist():
+            if not name.endswith('.npy'):
+                continue
+            dname, _sep, number = name[:-len('.npy')].rpartition('/')
+            if mmap_mode is None:
+                array = np.lib.format.read_array(
+                    io.BytesIO(archive.read(name)))
+            else:
+                array = _mmap_member(path, archive, name, mmap_mode)
+            members.setdefault(dname, {})[int(number)] = tuple(array)
+    finally:
+        archive.close()
+
+    output['data'] = {dname: [scans[i] for i in sorted(scans)]
+                      for dname, scans in members.iteritems()}
+    return output
+
+def save_plot(exp, path, figures=None):
     """Saves everything in exp.plots to path. Appends a number for duplicates.
     If no file extension or unknown, uses pdf.
+
+    Arguments:
+    figures -- dict of name: matplotlib Figure to save instead of exp.plots,
+        e.g. from plot.static_figures
     """
     name, _sep, ext = path.rpartition('.')
     if _sep == '':
@@ -249,10 +390,21 @@ def save_plot(exp, path):
     num = ''
     j = 0
     
-    for i in exp.plots: # Test for any existing files
+    plots = exp.plots if figures is None else figures
+
+    for i in plots: # Test for any existing files
         while os.path.exists("%s%s-%s.%s" % (name, num, i, ext)):
             j += 1
             num = j
     
-    for i in exp.plots: # save data
-        exp.plots[i].figure.savefig("%s%s-%s.%s" % (name, num, i, ext))
\ No newline at end of file
+    for i in plots: # save data
+        if figures is not None:
+            figures[i].savefig("%s%s-%s.%s" % (name, num, i, ext))
+            continue
+        plot = exp.plots[i]
+        if i == 'data': # decimate lines for resolution of saved figure
+            buckets = plot.buckets(dpi=plot.figure.dpi * SAVE_RESOLUTION)
+            for scan in range(min(len(exp.data['data']),
+                                  len(plot.axe1.lines))):
+                plot.updateline(exp, scan, buckets=buckets)
+        plot.figure.savefig("%s%s-%s.%s" % (name, num, i, ext))
\ No newline at end of file
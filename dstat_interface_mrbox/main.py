@@ -42,12 +42,12 @@ COLUMN_MAPPING : OrderedDict
 '''
 
 from collections import OrderedDict
-from copy import deepcopy
 from datetime import datetime
 import multiprocessing
 import os
 import pkg_resources as pk
 import sys
+import time
 import uuid
 
 try:
@@ -93,7 +93,8 @@ import parameter_test
 import analysis
 import zmq
 import db
-from errors import InputError
+from errors import InputError, HandshakeError
+from postprocess import PostProcessor
 
 from plugin import DstatPlugin, get_hub_uri
 
@@ -141,6 +142,15 @@ COLUMN_MAPPING = OrderedDict([(EXPERIMENT_TYPES.CA, ['current_amps']),
                               (EXPERIMENT_TYPES.PD, ['current_amps']),
                               (EXPERIMENT_TYPES.POT, ['voltage_volts'])])
 
+# Number of samples held in shared memory between serial and GUI processes.
+RING_BUFFER_SIZE = 2 ** 18
+
+# Live plot refresh interval bounds (ms). The interval is adapted to keep
+# drawing below 1/PLOT_LOAD_FACTOR of the main loop's time.
+PLOT_INTERVAL_MIN = 50
+PLOT_INTERVAL_MAX = 1000
+PLOT_LOAD_FACTOR = 5
+
 
 def dstat_data_to_frame(experiment_type, data):
     '''
@@ -183,6 +193,31 @@ def dstat_data_to_frame(experiment_type, data):
         return pd.concat(frames).reset_index(drop=True)
 
 
+def experiment_text(experiment):
+    """Returns text for raw data tab (commands, analysis and data) and FT
+    data tab of a finished experiment.
+    """
+    lines = []
+
+    if experiment.analysis != {}:
+        lines.append("# ANALYSIS")
+        for key, value in experiment.analysis.iteritems():
+            lines.append("#  %s:" % key)
+            for scan in value:
+                number, result = scan
+                lines.append("#    Scan %s -- %s" % (number, result))
+
+    raw = "".join(experiment.commands) + "\n"
+    raw += "".join("%s\n" % i for i in lines)
+    raw += "".join(save.iter_rows(experiment.data['data'], as_float=True))
+
+    ft = ""
+    if 'ft' in experiment.data:
+        ft = "".join(save.iter_rows(experiment.data['ft']))
+
+    return raw, ft
+
+
 class Main(object):
     """Main program """
     def __init__(self):
@@ -308,6 +343,19 @@ class Main(object):
         self.completed_experiment_data = OrderedDict()
         # Active experiment type code.
         self.active_experiment_type = None
+        # Update FT plot while experiment is running.
+        self.ft_live = False
+        # UUIDs of experiments in a running batch that haven't finished.
+        self.queued_experiment_ids = []
+        # UUIDs of batch experiments not run because an earlier one failed.
+        self.skipped_experiment_ids = set()
+        # UUIDs of acquired experiments still being analysed and saved.
+        self.processing_experiment_ids = set()
+        # Messages of experiments whose post-processing or database commit
+        # failed, by UUID.
+        self.failed_experiment_ids = OrderedDict()
+        self.postprocessor = PostProcessor(run_in_main=gobject.idle_add,
+                                           notify=self.postprocess_progress)
 
     def on_window1_destroy(self, object, data=None):
         """ Quit when main window closed."""
@@ -322,6 +370,10 @@ class Main(object):
         params.save_params(self, 'last_params.yml')
 
         self.on_serial_disconnect_clicked()
+        # Finish saving experiments, some stages run in main loop
+        while self.postprocessor.pending:
+            gtk.main_iteration(False)
+            time.sleep(0.01)
         db.stop_db()
         gtk.main_quit()
 
@@ -356,7 +408,8 @@ class Main(object):
         try:
             self.serial_connect.set_sensitive(False)
             self.version = comm.version_check(self.serial_liststore.get_value(
-                                    self.serial_combobox.get_active_iter(), 0))
+                                    self.serial_combobox.get_active_iter(), 0),
+                                    ring_buffer_size=RING_BUFFER_SIZE)
 
             self.statusbar.remove_all(self.error_context_id)
 
@@ -387,12 +440,22 @@ class Main(object):
         except TypeError as err:
             logger.warning("TypeError: %s", err)
             self.serial_connect.set_sensitive(True)
+        except (SerialException, HandshakeError) as err:
+            logger.error("%s: %s", type(err).__name__, err)
+            comm.serial_instance.disconnect()
+            self.statusbar.remove_all(self.error_context_id)
+            self.statusbar.push(self.error_context_id,
+                                "Could not read DStat settings.")
+            self.serial_connect.set_sensitive(True)
 
         if self.params_loaded == False:
             try:
                 params.load_params(self, 'last_params.yml')
             except IOError:
                 logger.info("No previous parameters found.")
+            # Connect to database in background now that its settings are
+            # loaded, not when acquiring
+            self.start_db()
 
     def on_serial_disconnect_clicked(self, data=None):
         """Disconnect from DStat."""
@@ -435,11 +498,11 @@ class Main(object):
 
             if self.pmt_mode == True:
                 logger.info("Start PMT idle mode")
-                comm.serial_instance.proc_pipe_p.send(comm.PMTIdle())
+                comm.serial_instance.submit(comm.PMTIdle())
 
             else:
                 logger.info("Start OCP")
-                comm.serial_instance.proc_pipe_p.send(comm.OCPExp())
+                comm.serial_instance.submit(comm.OCPExp())
 
             self.ocp_proc = (gobject.timeout_add(300, self.ocp_running_data),
                              gobject.timeout_add(250, self.ocp_running_proc)
@@ -480,22 +543,20 @@ class Main(object):
         """
 
         try:
-            if comm.serial_instance.data_pipe_p.poll():
+            incoming = None
+            while comm.serial_instance.data_pipe_p.poll():
                 incoming = comm.serial_instance.data_pipe_p.recv()
 
                 if isinstance(incoming, basestring): # test if incoming is str
                     self.on_serial_disconnect_clicked()
                     return False
 
+            if incoming is not None:
                 data = "".join(["OCP: ",
                                 "{0:.3f}".format(incoming),
                                 " V"])
                 self.ocp_disp.set_text(data)
 
-                if comm.serial_instance.data_pipe_p.poll():
-                    self.ocp_running_data()
-                return True
-
             return True
 
         except EOFError:
@@ -541,6 +602,52 @@ class Main(object):
             # Ignore expected exceptions when triggering experiment from UI.
             pass
 
+    def _build_experiment(self, experiment_type, parameters):
+        """Check parameters and create the Experiment instance for
+        experiment_type. Raises InputError if experiment_type can't be run
+        on the connected DStat.
+        """
+        if experiment_type == EXPERIMENT_TYPES.CA:
+            # Add experiment parameters to existing
+            parameters.update(self.exp_window.get_params('cae'))
+            if not parameters['potential']:
+                raise InputError(parameters['potential'],
+                                 "Step table is empty")
+
+            return comm.Chronoamp(parameters)
+
+        elif experiment_type == EXPERIMENT_TYPES.LSV:
+            parameter_test.lsv_test(parameters)
+            return comm.LSVExp(parameters)
+
+        elif experiment_type == EXPERIMENT_TYPES.CV:
+            parameter_test.cv_test(parameters)
+            return comm.CVExp(parameters)
+
+        elif experiment_type == EXPERIMENT_TYPES.SWV:
+            parameter_test.swv_test(parameters)
+            return comm.SWVExp(parameters)
+
+        elif experiment_type == EXPERIMENT_TYPES.DPV:
+            parameter_test.dpv_test(parameters)
+            return comm.DPVExp(parameters)
+
+        elif experiment_type == EXPERIMENT_TYPES.PD:
+            parameter_test.pd_test(parameters)
+            return comm.PDExp(parameters)
+
+        elif experiment_type == EXPERIMENT_TYPES.POT:
+            if not (self.version[0] >= 1 and self.version[1] >= 2):
+                raise InputError(experiment_type,
+                                 "v1.1 board does not support potentiometry.")
+
+            parameter_test.pot_test(parameters)
+            return comm.PotExp(parameters)
+
+        else:
+            raise InputError(experiment_type,
+                             "Experiment not yet implemented.")
+
     def run_active_experiment(self, param_override=None, metadata=None):
         """Run currently visible experiment."""
         # Assign current experiment a unique identifier.
@@ -581,23 +688,29 @@ class Main(object):
                 #     nb.page_num(self.period_window)).show()
                 self.ft_plot.clearall()
                 self.ft_plot.changetype(self.current_exp)
+                self.ft_live = True
             else:
+                self.ft_live = False
                 nb.get_nth_page(nb.page_num(self.ft_window)).hide()
                 # nb.get_nth_page(nb.page_num(self.period_window)).hide()
 
             if parameters['db_enable_checkbutton']:
-                if db.current_db is None:
-                    db.start_db()
-                elif not db.current_db.connected:
-                    db.restart_db()
-
-            comm.serial_instance.proc_pipe_p.send(self.current_exp)
+                self.start_db()
 
-            # Flush data pipe
+            # Flush data pipe and shared memory
             while comm.serial_instance.data_pipe_p.poll():
                 comm.serial_instance.data_pipe_p.recv()
+            ring_buffer = comm.serial_instance.ring_buffer
+            if ring_buffer is not None:
+                for i in ring_buffer.read(0):
+                    pass
+                self.dropped_samples = ring_buffer.dropped
 
-            self.plot_proc = gobject.timeout_add(200,
+            comm.serial_instance.submit(self.current_exp)
+
+            self.plot.start_live()
+            self.plot_interval = 200
+            self.plot_proc = gobject.timeout_add(self.plot_interval,
                                                 self.experiment_running_plot)
             self.experiment_proc = (
                     gobject.idle_add(self.experiment_running_data),
@@ -625,90 +738,25 @@ class Main(object):
 
             self.line = 0
             self.lastline = 0
-            self.lastdataline = 0
 
             self.spinner.start()
             self.startbutton.set_sensitive(False)
             self.stopbutton.set_sensitive(True)
             self.statusbar.remove_all(self.error_context_id)
 
-            if self.active_experiment_type == EXPERIMENT_TYPES.CA:
-                # Add experiment parameters to existing
-                parameters.update(self.exp_window.get_params('cae'))
-                if not parameters['potential']:
-                    raise InputError(parameters['potential'],
-                                     "Step table is empty")
-
-                self.current_exp = comm.Chronoamp(parameters)
+            self.current_exp = self._build_experiment(
+                self.active_experiment_type, parameters)
 
+            if self.active_experiment_type == EXPERIMENT_TYPES.CA:
                 self.rawbuffer.set_text("")
                 self.rawbuffer.place_cursor(self.rawbuffer.get_start_iter())
 
                 for i in self.current_exp.commands:
                     self.rawbuffer.insert_at_cursor(i)
 
-                run_experiment()
-
-                return experiment_id
-
-            elif self.active_experiment_type == EXPERIMENT_TYPES.LSV:
-                parameter_test.lsv_test(parameters)
-
-                self.current_exp = comm.LSVExp(parameters)
-                run_experiment()
-
-                return experiment_id
-
-            elif self.active_experiment_type == EXPERIMENT_TYPES.CV:
-                parameter_test.cv_test(parameters)
-
-                self.current_exp = comm.CVExp(parameters)
-                run_experiment()
-
-                return experiment_id
-
-            elif self.active_experiment_type == EXPERIMENT_TYPES.SWV:
-                parameter_test.swv_test(parameters)
-
-                self.current_exp = comm.SWVExp(parameters)
-                run_experiment()
-
-                return experiment_id
-
-            elif self.active_experiment_type == EXPERIMENT_TYPES.DPV:
-                parameter_test.dpv_test(parameters)
-
-                self.current_exp = comm.DPVExp(parameters)
-                run_experiment()
-
-                return experiment_id
-
-            elif self.active_experiment_type == EXPERIMENT_TYPES.PD:
-                parameter_test.pd_test(parameters)
-
-                self.current_exp = comm.PDExp(parameters)
-                run_experiment()
-
-                return experiment_id
-
-            elif self.active_experiment_type == EXPERIMENT_TYPES.POT:
-                if not (self.version[0] >= 1 and self.version[1] >= 2):
-                    self.statusbar.push(self.error_context_id,
-                                "v1.1 board does not support potentiometry.")
-                    exceptions()
-                    return
+            run_experiment()
 
-                parameter_test.pot_test(parameters)
-
-                self.current_exp = comm.PotExp(parameters)
-                run_experiment()
-
-                return experiment_id
-
-            else:
-                self.statusbar.push(self.error_context_id,
-                                    "Experiment not yet implemented.")
-                exceptions()
+            return experiment_id
 
         except ValueError as i:
             logger.info("ValueError: %s",i)
@@ -743,32 +791,219 @@ class Main(object):
             exceptions()
             raise
 
-    def experiment_running_data(self):
-        """Receive data from experiment process and add to
-        current_exp.data['data].
+    def run_experiment_batch(self, param_overrides, metadata=None):
+        """Run several experiments back-to-back in the serial process without
+        restarting OCP in between. Results are processed as each experiment
+        finishes.
+
+        Arguments:
+        param_overrides -- list of parameter dicts as accepted by
+            params.set_params, one per experiment. 'experiment_index' selects
+            the experiment type.
+        metadata -- external metadata used for all experiments in batch.
+
+        Returns:
+        list of experiment UUIDs in batch order.
+        """
+        self.metadata = metadata
+
+        if self.metadata is not None:
+            logger.info("Loading external metadata")
+            self.db_window.update_from_metadata(self.metadata)
+        elif self.db_window.params['exp_id_entry'] is None:
+            logger.info("DB exp_id field blank, autogenerating")
+            self.db_window.on_exp_id_autogen_button_clicked()
+
+        self.statusbar.remove_all(self.error_context_id)
+
+        # Build all experiments first so invalid parameters don't leave a
+        # partially run batch.
+        self.batch = []
+        try:
+            for param_override in param_overrides:
+                experiment_id = uuid.uuid4()
+                self.db_window.params = {'measure_id_entry':experiment_id.hex}
+                params.set_params(self, param_override)
+
+                parameters = {}
+                parameters['version'] = self.version
+                parameters['metadata'] = self.metadata
+                parameters['sync_true'] = False
+                parameters['shutter_true'] = False
+                parameters.update(params.get_params(self))
+
+                experiment_type = self.expcombobox.get_active()
+                self.batch.append(
+                    (experiment_id, experiment_type,
+                     self._build_experiment(experiment_type, parameters))
+                )
+
+        except (ValueError, KeyError) as err:
+            logger.info("%s: %s", type(err).__name__, err)
+            self.statusbar.push(self.error_context_id,
+                                "Experiment parameters must be integers.")
+            raise
+        except InputError as err:
+            logger.info("InputError: %s", err)
+            self.statusbar.push(self.error_context_id, err.msg)
+            raise
+        except AssertionError as err:
+            logger.info("AssertionError: %s", err)
+            self.statusbar.push(self.error_context_id, str(err))
+            raise
+
+        self.stop_ocp()
+
+        self.spinner.start()
+        self.startbutton.set_sensitive(False)
+        self.stopbutton.set_sensitive(True)
+
+        if any(experiment.parameters['db_enable_checkbutton']
+               for experiment_id, experiment_type, experiment in self.batch):
+            self.start_db()
+
+        while comm.serial_instance.data_pipe_p.poll(): # Clear data pipe
+            comm.serial_instance.data_pipe_p.recv()
+
+        self.queued_experiment_ids = [i[0] for i in self.batch]
+        self.active_experiment_id, self.active_experiment_type = \
+            self.batch[0][:2]
+        logger.info("Running batch of %s experiments", len(self.batch))
+
+        comm.serial_instance.submit(
+            comm.ExperimentBatch(i[2] for i in self.batch))
+
+        self.experiment_proc = (
+                gobject.timeout_add(100, self.batch_running_data),
+                gobject.timeout_add(250, self.batch_running_proc)
+                                )
+
+        return [i[0] for i in self.batch]
+
+    def batch_running_data(self):
+        """Receive BatchResults from experiment process. Each finished
+        experiment is plotted, analysed and saved.
         Run in GTK main loop.
 
         Returns:
-        True -- when experiment is continuing to keep function in GTK's queue.
+        True -- when batch is continuing to keep function in GTK's queue.
         False -- when experiment process signals EOFError or IOError to remove
             function from GTK's queue.
         """
         try:
-            if comm.serial_instance.data_pipe_p.poll():
-                incoming = comm.serial_instance.data_pipe_p.recv()
+            while comm.serial_instance.data_pipe_p.poll():
+                result = comm.serial_instance.data_pipe_p.recv()
+                if not isinstance(result, comm.BatchResult):
+                    continue
+                self.batch_result(result)
+            return True
 
-                self.line, data = incoming
-                if self.line > self.lastdataline:
-                    self.current_exp.data['data'].append(
-                        deepcopy(self.current_exp.line_data))
-                    self.lastdataline = self.line
+        except (EOFError, IOError) as err:
+            logger.warning("%s: %s", type(err).__name__, err)
+            self.batch_done("SERIAL_ERROR")
+            return False
 
-                for i in range(len(self.current_exp.data['data'][self.line])):
-                    self.current_exp.data['data'][self.line][i].append(data[i])
+    def batch_result(self, result):
+        """Process one BatchResult from a running batch."""
+        experiment_id, experiment_type, experiment = self.batch[result.index]
+        self.queued_experiment_ids.remove(experiment_id)
 
-                if comm.serial_instance.data_pipe_p.poll():
-                    self.experiment_running_data()
-                return True
+        if result.index + 1 < len(self.batch):
+            self.active_experiment_id, self.active_experiment_type = \
+                self.batch[result.index + 1][:2]
+
+        if result.status == "SKIPPED":
+            logger.info("Batch: skipped experiment %s", experiment_id.hex)
+            self.skipped_experiment_ids.add(experiment_id)
+            return
+
+        experiment.data = result.data
+        experiment.time = result.time
+        self.current_exp = experiment
+
+        self.plot.clearall()
+        self.plot.changetype(experiment)
+        for scan in range(len(experiment.data['data'])):
+            if scan > 0:
+                self.plot.addline()
+            self.plot.updateline(experiment, scan)
+        self.plot.redraw()
+
+        self.postprocess_experiment(experiment, experiment_id,
+                                    experiment_type)
+
+        self.statusbar.push(self.message_context_id,
+                            "Batch: experiment %s of %s finished" % (
+                                result.index + 1, len(self.batch)))
+
+    def batch_running_proc(self):
+        """Receive final batch status from experiment process.
+        Run in GTK main loop.
+
+        Returns:
+        True -- when batch is continuing to keep function in GTK's queue.
+        False -- when batch has finished to remove function from GTK's queue.
+        """
+        try:
+            if comm.serial_instance.proc_pipe_p.poll():
+                proc_buffer = comm.serial_instance.proc_pipe_p.recv()
+
+                if proc_buffer not in ["DONE", "SERIAL_ERROR", "ABORT"]:
+                    logger.warning("Unrecognized experiment return code: %s",
+                                   proc_buffer)
+
+                self.batch_done(proc_buffer)
+                return False
+
+            return True
+
+        except (EOFError, IOError) as err:
+            logger.warning("%s: %s", type(err).__name__, err)
+            self.batch_done("SERIAL_ERROR")
+            return False
+
+    def batch_done(self, status):
+        """Clean up after a batch has finished or failed."""
+        try:
+            gobject.source_remove(self.experiment_proc[0])
+            self.batch_running_data()  # receive results still in pipe
+        finally:
+            self.metadata = None # Reset metadata
+            # Experiments without a result won't be run
+            self.skipped_experiment_ids.update(self.queued_experiment_ids)
+            self.queued_experiment_ids = []
+
+            self.spinner.stop()
+            self.startbutton.set_sensitive(True)
+            self.stopbutton.set_sensitive(False)
+
+            if status == "SERIAL_ERROR":
+                self.on_serial_disconnect_clicked()
+            else:
+                self.start_ocp()
+
+    def experiment_running_data(self):
+        """Receive blocks of data from experiment process and add to
+        current_exp.data['data]. Drains all pending blocks on each call.
+        Run in GTK main loop.
+
+        Returns:
+        True -- when experiment is continuing to keep function in GTK's queue.
+        False -- when experiment process signals EOFError or IOError to remove
+            function from GTK's queue.
+        """
+        try:
+            ring_buffer = comm.serial_instance.ring_buffer
+            if ring_buffer is not None and ring_buffer.available:
+                for scan, columns in ring_buffer.read(
+                        self.current_exp.data['data'].columns):
+                    self.current_exp.store_block(scan, columns)
+                    self.line = max(self.line, scan)
+
+            while comm.serial_instance.data_pipe_p.poll():
+                scan, columns = comm.serial_instance.data_pipe_p.recv()
+                self.current_exp.store_block(scan, columns)
+                self.line = max(self.line, scan)
 
             return True
 
@@ -817,140 +1052,80 @@ class Main(object):
             return False
 
     def experiment_running_plot(self):
-        """Plot all data in current_exp.data.
-        Run in GTK main loop. Always returns True so must be manually
-        removed from GTK's queue.
+        """Plot new data in current_exp.data using the plot's live mode.
+        Run in GTK main loop. The refresh interval follows the time taken
+        to draw: if it changes, the function reschedules itself and returns
+        False, otherwise returns True. Must be manually removed from GTK's
+        queue using self.plot_proc.
         """
-        if self.line > self.lastline:
+        start = time.time()
+
+        # make sure all of last line is added
+        lines = range(self.lastline, self.line + 1)
+        for i in range(self.lastline, self.line):
             self.plot.addline()
-            # make sure all of last line is added
-            self.plot.updateline(self.current_exp, self.lastline)
-            self.lastline = self.line
-        self.plot.updateline(self.current_exp, self.line)
-        self.plot.redraw()
+        self.lastline = self.line
+        self.plot.update_live(self.current_exp, lines)
+
+        if self.ft_live:
+            integral = self.ft_plot.update_live(self.current_exp)
+            if integral is not None:
+                self.statusbar.remove_all(self.message_context_id)
+                self.statusbar.push(self.message_context_id,
+                                    "Integral (live): %s A" % integral)
+
+        ring_buffer = comm.serial_instance.ring_buffer
+        if (ring_buffer is not None and
+                ring_buffer.dropped > self.dropped_samples):
+            self.statusbar.remove_all(self.error_context_id)
+            self.statusbar.push(self.error_context_id,
+                                "%s samples dropped" % (ring_buffer.dropped -
+                                                        self.dropped_samples))
+
+        draw_ms = (time.time() - start) * 1000
+        interval = int(min(max(draw_ms * PLOT_LOAD_FACTOR, PLOT_INTERVAL_MIN),
+                           PLOT_INTERVAL_MAX))
+        if abs(interval - self.plot_interval) > self.plot_interval // 4:
+            self.plot_interval = interval
+            self.plot_proc = gobject.timeout_add(interval,
+                                                 self.experiment_running_plot)
+            return False
         return True
 
     def experiment_done(self):
         """Clean up after data acquisition is complete. Update plot and
-        copy data to raw data tab. Saves data if autosave enabled.
+        queue analysis and saving in the post-processing thread.
         """
         try:
             self.current_exp.time = datetime.now()
             gobject.source_remove(self.experiment_proc[0])
+            self.experiment_running_data()  # receive blocks still in pipe
+
+            ring_buffer = comm.serial_instance.ring_buffer
+            if ring_buffer is not None:
+                self.current_exp.dropped_samples = (ring_buffer.dropped -
+                                                    self.dropped_samples)
+                if self.current_exp.dropped_samples:
+                    logger.warning("%s samples dropped, data has gaps",
+                                   self.current_exp.dropped_samples)
             gobject.source_remove(self.plot_proc)  # stop automatic plot update
-            self.experiment_running_plot()  # make sure all data updated on plot
-
+            self.plot.stop_live()
+            # make sure all data updated on plot
+            for i in range(self.lastline, self.line):
+                self.plot.addline()
+            for scan in range(self.line + 1):
+                self.plot.updateline(self.current_exp, scan)
+            self.plot.redraw()
+
+            # Filled in by post-processing
             self.databuffer.set_text("")
-            self.databuffer.place_cursor(self.databuffer.get_start_iter())
-            self.rawbuffer.insert_at_cursor("\n")
             self.rawbuffer.set_text("")
-            self.rawbuffer.place_cursor(self.rawbuffer.get_start_iter())
 
             # Shutter stuff
             if (self.current_exp.parameters['shutter_true'] and
                 self.current_exp.parameters['sync_true']):
                 self.ft_plot.updateline(self.current_exp, 0)
                 self.ft_plot.redraw()
-
-                line_buffer = []
-
-                for scan in self.current_exp.data['ft']:
-                    for dimension in scan:
-                        for i in range(len(dimension)):
-                            try:
-                                line_buffer[i] += "%s     " % dimension[i]
-                            except IndexError:
-                                line_buffer.append("")
-                                line_buffer[i] += "%s     " % dimension[i]
-
-                for i in line_buffer:
-                    self.databuffer.insert_at_cursor("%s\n" % i)
-
-            # Run Analysis
-            analysis.do_analysis(self.current_exp)
-
-            # Write DStat commands
-            for i in self.current_exp.commands:
-                self.rawbuffer.insert_at_cursor(i)
-
-            self.rawbuffer.insert_at_cursor("\n")
-
-            try:
-                self.statusbar.push(
-                    self.message_context_id,
-                    "Integral: %s A" % self.current_exp.analysis['FT Integral'][0][1]
-                )
-            except KeyError:
-                pass
-
-            # Data Output
-            analysis_buffer = []
-
-            if self.current_exp.analysis != {}:
-                analysis_buffer.append("# ANALYSIS")
-                for key, value in self.current_exp.analysis.iteritems():
-                    analysis_buffer.append("#  %s:" % key)
-                    for scan in value:
-                        number, result = scan
-                        analysis_buffer.append(
-                            "#    Scan %s -- %s" % (number, result)
-                            )
-
-            for i in analysis_buffer:
-                self.rawbuffer.insert_at_cursor("%s\n" % i)
-
-            line_buffer = []
-
-            for scan in self.current_exp.data['data']:
-                for dimension in scan:
-                    for i in range(len(dimension)):
-                        try:
-                            line_buffer[i] += "%s     " % dimension[i]
-                        except IndexError:
-                            line_buffer.append("")
-                            line_buffer[i] += "%s     " % dimension[i]
-
-            for i in line_buffer:
-                self.rawbuffer.insert_at_cursor("%s\n" % i)
-
-            # Autosaving
-            if self.autosave_checkbox.get_active():
-                save.autoSave(self.current_exp,
-                              self.autosavedir_button.get_filename(),
-                              self.autosavename.get_text()
-                              )
-
-                save.autoPlot(self.current_exp,
-                              self.autosavedir_button.get_filename(),
-                              self.autosavename.get_text()
-                              )
-            # Database output
-            if self.current_exp.parameters['db_enable_checkbutton']:
-                meta = {}
-
-                if self.current_exp.parameters['metadata'] is not None:
-                    metadata = self.current_exp.parameters['metadata']
-                    exp_metakeys = ['experiment_uuid', 'patient_id', 'name']
-                    meta.update(
-                                {k: metadata[k]
-                                 for k in metadata
-                                 if k not in exp_metakeys
-                                 }
-                                )
-
-                name = self.current_exp.parameters['measure_name_entry']
-
-                newname = db.current_db.add_results(
-                    measurement_uuid=self.active_experiment_id.hex,
-                    measurement_name=name,
-                    experiment_uuid=self.current_exp.parameters['exp_id_entry'],
-                    experiment_metadata=meta,
-                    patient_id=self.current_exp.parameters['patient_id_entry'],
-                    timestamp=None,
-                    data=self.current_exp.export()
-                    )
-
-                self.db_window.params = {'measure_name_entry':newname}
         # uDrop
         # UI stuff
         finally:
@@ -961,12 +1136,172 @@ class Main(object):
             self.stopbutton.set_sensitive(False)
 
             self.start_ocp()
+            # Analyse and save in background, next experiment can start now
+            self.postprocess_experiment(self.current_exp,
+                                        self.active_experiment_id,
+                                        self.active_experiment_type)
+
+    def postprocess_experiment(self, experiment, experiment_id,
+                               experiment_type):
+        """Queue analysis, text output, autosave, database output and
+        conversion to `pandas.DataFrame` of a finished experiment in the
+        post-processing thread. Progress is shown in the status bar. The
+        experiment is marked complete once every stage has finished and its
+        measurement is committed to the database, or failed if any of them
+        fails.
+        """
+        self.processing_experiment_ids.add(experiment_id)
+
+        def show_text():
+            raw_text, ft_text = experiment_text(experiment)
+
+            def show():
+                if experiment is not self.current_exp:
+                    return  # a newer experiment is displayed
+                self.rawbuffer.set_text(raw_text)
+                self.databuffer.set_text(ft_text)
+                try:
+                    self.statusbar.push(
+                        self.message_context_id,
+                        "Integral: %s A" % experiment.analysis['FT Integral'][0][1]
+                    )
+                except KeyError:
+                    pass
+
+            self.postprocessor.in_main(show)()
+
+        def data_frame():
             # Save current measurements for experiment in `pandas.DataFrame`.
-            self.completed_experiment_data[self.active_experiment_id] =\
-                dstat_data_to_frame(self.active_experiment_type,
-                                    self.current_exp.data['data'])
-            self.completed_experiment_ids[self.active_experiment_id] =\
-                datetime.utcnow()
+            self.completed_experiment_data[experiment_id] =\
+                dstat_data_to_frame(experiment_type, experiment.data['data'])
+
+        stages = [('analysis', lambda: analysis.do_analysis(experiment)),
+                  ('text output', show_text)]
+
+        # Autosaving, read settings now as widgets only work in main thread
+        if self.autosave_checkbox.get_active():
+            path = self.autosavedir_button.get_filename()
+            name = self.autosavename.get_text()
+            stages.append(('autosaving data',
+                           lambda: save.autoSave(experiment, path, name)))
+            stages.append(('autosaving plots',
+                           lambda: save.autoPlot(
+                               experiment, path, name,
+                               plot.static_figures(experiment,
+                                                   save.SAVE_RESOLUTION))))
+
+        # The experiment is complete once all stages have finished and,
+        # with database output, the writer thread has committed it.
+        pending = {'stages': True,
+                   'database': experiment.parameters['db_enable_checkbutton']}
+        failures = []
+
+        def finish(job):
+            if experiment_id not in self.processing_experiment_ids:
+                return  # already marked failed
+            if failures:
+                self.processing_experiment_ids.discard(experiment_id)
+                message = "Experiment %s: %s failed" % (job,
+                                                        ", ".join(failures))
+                self.failed_experiment_ids[experiment_id] = message
+            elif any(pending.values()):
+                return
+            else:
+                self.processing_experiment_ids.discard(experiment_id)
+                self.completed_experiment_ids[experiment_id] =\
+                    datetime.utcnow()
+                message = "Experiment %s: complete" % job
+            self.statusbar.push(self.message_context_id, message)
+
+        def committed(error):
+            pending['database'] = False
+            if error is not None:
+                failures.append('database commit')
+            finish(experiment_id.hex[:8])
+
+        if pending['database']:
+            stages.append(('database output',
+                           lambda: self.save_to_db(experiment, experiment_id,
+                                                   callback=committed)))
+
+        stages.append(('data frame', data_frame))
+
+        def done(job, errors):
+            def complete():
+                pending['stages'] = False
+                failures.extend(stage for stage, err in errors)
+                finish(job)
+
+            self.postprocessor.in_main(complete)()
+
+        self.postprocessor.submit(experiment_id.hex[:8], stages, done)
+
+    def postprocess_progress(self, job, stage, index, total):
+        """Show progress of post-processing thread in status bar. Called in
+        post-processing thread.
+        """
+        message = "Experiment %s: %s (%s/%s)" % (job, stage, index + 1, total)
+
+        def push():
+            self.statusbar.push(self.message_context_id, message)
+            return False
+
+        gobject.idle_add(push)
+
+    def start_db(self):
+        """Connect to database in background if enabled. Keeps an existing
+        connection to the same data directory, so this is cheap to call
+        before every experiment.
+        """
+        db_params = self.db_window.params
+        if db_params['db_enable_checkbutton']:
+            db.start_db(path=db_params['db_path_entry'])
+
+    def save_to_db(self, experiment, experiment_id, callback=None):
+        """Queue results of a finished experiment for the database writer
+        thread. Doesn't wait for the commit.
+
+        Arguments:
+        callback -- called in main thread as callback(error) once the
+            measurement is committed (error None) or failed
+        """
+        meta = {}
+
+        if experiment.parameters['metadata'] is not None:
+            metadata = experiment.parameters['metadata']
+            exp_metakeys = ['experiment_uuid', 'patient_id', 'name']
+            meta.update(
+                        {k: metadata[k]
+                         for k in metadata
+                         if k not in exp_metakeys
+                         }
+                        )
+
+        name = experiment.parameters['measure_name_entry']
+
+        def committed(newname, error):
+            if error is None:
+                gobject.idle_add(self.set_db_measurement_name, newname)
+            if callback is not None:
+                gobject.idle_add(callback, error)
+
+        db.current_db.submit(
+            callback=committed,
+            measurement_uuid=experiment_id.hex,
+            measurement_name=name,
+            experiment_uuid=experiment.parameters['exp_id_entry'],
+            experiment_metadata=meta,
+            patient_id=experiment.parameters['patient_id_entry'],
+            timestamp=None,
+            data=experiment.export()
+            )
+
+    def set_db_measurement_name(self, name):
+        """Show name measurement was saved to database with. Run in GTK
+        main loop.
+        """
+        self.db_window.params = {'measure_name_entry':name}
+        return False
 
     def on_pot_stop_clicked(self, data=None):
         """Stop current experiment. Signals experiment process to stop."""
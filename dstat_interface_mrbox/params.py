@@ -64,9 +64,12 @@ def load_params(window, path):
     except InputError:  # Will be thrown because no experiment will be selected
         pass
 
+    set_params(window, read_params(path))
+
+def read_params(path):
+    """Returns dict of params saved in path by save_params."""
     with open(path, 'r') as f:
-        params = yaml.load(f)
-    set_params(window, params)
+        return yaml.load(f)
 
 def set_params(window, params):
     window.adc_pot.params = params
@@ -39,9 +39,10 @@ try:
 except ImportError:
     pass
 
-from numpy import mean, trapz
+from numpy import array, asarray, flatnonzero, mean, searchsorted, trapz
 from scipy import fft, arange
-from analysis import dstat_to_fft_frame
+from analysis import dstat_to_fft_frame, WelchEstimator, welch_segment
+from decimate import TracePyramid, envelope
 
 
 # Format float values as string w.r.t. amps, e.g., `A`, `mA`, `uA`, etc.
@@ -84,20 +85,25 @@ def integrateSpectrum(x, y, target, bandwidth):
     return trapz(y=y[j:k], x=x[j:k])
 
 def findBounds(y):
-    start_index = 0;
-    stop_index = len(y)-1;
-
-    for i in range(len(y)):
-        if (y[i] <= mean(y) and y[i+1] > mean(y)):
-            start_index = i
-            break
+    """Returns indices of first and last rising crossing of the mean of y,
+    (0, len(y)-1) if there is none.
+    """
+    y = asarray(y)
+    avg = mean(y)
+    rising = flatnonzero((y[:-1] <= avg) & (y[1:] > avg))
 
-    for i in range(len(y)):
-        if (y[-(i+1)] <= mean(y) and y[-i] > mean(y)):
-            stop_index = len(y)-1-i  # len(y) is last index + 1
-            break
+    if not len(rising):
+        return (0, len(y)-1)
+    return (rising[0], rising[-1])
 
-    return (start_index, stop_index)
+def search_value(data, target):
+    """Returns index of first value of sorted data greater than target, 0 if
+    there is none.
+    """
+    index = int(searchsorted(data, target, side='right'))
+    if index == len(data):
+        return 0
+    return index
 
 
 class PlotBox(object):
@@ -128,10 +134,132 @@ class PlotBox(object):
         self.vbox.pack_start(self.toolbar, False, False)
         self.vbox.reparent(plotwindow_instance)
 
+        self.live = False
+        self.background = None
+        self._draw_cid = None
+
+        # Multi-resolution index of each line, used on zoom and pan
+        self.experiment = None
+        self.pyramids = {}
+        self.axe1.callbacks.connect('xlim_changed', self._on_xlim_changed)
+
+    def start_live(self):
+        """Enter live mode for plotting a running experiment. Lines are
+        blitted over a cached background and only the axes limits are
+        redrawn when new data falls outside them.
+        """
+        self.stop_live()
+        self.live = True
+        self._ylim = None
+        self._seen = {}
+        for line in self.axe1.lines:
+            line.set_animated(True)
+        self._draw_cid = self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.canvas.draw()
+
+    def stop_live(self):
+        """Leave live mode and draw lines normally."""
+        if self._draw_cid is not None:
+            self.canvas.mpl_disconnect(self._draw_cid)
+            self._draw_cid = None
+        for line in self.axe1.lines:
+            line.set_animated(False)
+        self.live = False
+        self.background = None
+
+    def _on_draw(self, event):
+        """Cache background after a full draw and put lines back on it."""
+        self.background = self.canvas.copy_from_bbox(self.axe1.bbox)
+        self._blit_lines()
+
+    def _blit_lines(self):
+        for line in self.axe1.lines:
+            self.axe1.draw_artist(line)
+        self.canvas.blit(self.axe1.bbox)
+
+    def buckets(self, dpi=None):
+        """Returns number of decimation buckets for lines, one per pixel of
+        axes width at dpi (default: screen).
+        """
+        width = self.axe1.bbox.width
+        if dpi is not None:
+            width *= float(dpi) / self.figure.dpi
+        return max(int(width), 100)
+
+    def _line_data(self, Experiment, line_number, buckets=None):
+        """Adds new samples of line_number to its TracePyramid and returns
+        (x, y) to draw for the visible x range.
+        """
+        if buckets is None:
+            buckets = self.buckets()
+        x, y = Experiment.data['data'][line_number][:2]
+        x, y = x[1:], y[1:]  # first sample is not plotted
+
+        if line_number not in self.pyramids:
+            self.pyramids[line_number] = TracePyramid()
+        pyramid = self.pyramids[line_number]
+        pyramid.update(x, y)
+
+        xmin, xmax = sorted(self.axe1.get_xlim())
+        return pyramid.query(x, y, xmin, xmax, buckets)
+
+    def _on_xlim_changed(self, axes):
+        """Redecimate lines for new x range after zoom or pan."""
+        if self.experiment is None:
+            return
+        for line_number in self.pyramids:
+            if line_number < len(self.axe1.lines):
+                self.axe1.lines[line_number].set_data(
+                    self._line_data(self.experiment, line_number))
+
+    def update_live(self, Experiment, line_numbers):
+        """Update lines in live mode and refresh plot. Only samples received
+        since the last update are examined. Lines are drawn from the level
+        of their TracePyramid giving about one block per pixel, so drawing
+        cost doesn't grow with the length of the run.
+
+        Arguments:
+        Experiment -- running Experiment instance
+        line_numbers -- scans to update
+        """
+        new_min = new_max = None
+
+        for line_number in line_numbers:
+            x, y = Experiment.data['data'][line_number][:2]
+            seen = self._seen.get(line_number, 0)
+            if len(y) > seen:
+                new_y = y[seen:]
+                low, high = new_y.min(), new_y.max()
+                new_min = low if new_min is None else min(new_min, low)
+                new_max = high if new_max is None else max(new_max, high)
+            self._seen[line_number] = len(y)
+
+            line = self.axe1.lines[line_number]
+            line.set_animated(True)
+            line.set_data(self._line_data(Experiment, line_number))
+
+        if new_min is not None and (self._ylim is None or
+                                    new_min < self._ylim[0] or
+                                    new_max > self._ylim[1]):
+            if self._ylim is not None:
+                new_min = min(new_min, self._ylim[0])
+                new_max = max(new_max, self._ylim[1])
+            margin = (new_max - new_min) * .05 or abs(new_max) * .05 or 1e-12
+            self._ylim = (new_min - margin, new_max + margin)
+            self.axe1.set_ylim(*self._ylim)
+            self.canvas.draw()  # new background, lines blitted in _on_draw
+        elif self.background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._blit_lines()
+
     def clearall(self):
         """Remove all lines on plot. """
         for i in range(len(self.axe1.lines)):
             self.axe1.lines.pop(0)
+        self.experiment = None
+        self.pyramids = {}
         self.addline()
 
     def clearline(self, line_number):
@@ -143,17 +271,16 @@ class PlotBox(object):
         """Add a new line to plot. (initialized with dummy data)))"""
         self.axe1.plot([0, 1], [0, 1])
 
-    def updateline(self, Experiment, line_number):
+    def updateline(self, Experiment, line_number, buckets=None):
         """Update a line specified by line_number with data stored in
         the Experiment instance.
-        """
-        # limits display to 2000 data points per line
-        divisor = len(Experiment.data['data'][line_number][0]) // 2000 + 1
 
-        self.axe1.lines[line_number].set_ydata(
-                Experiment.data['data'][line_number][1][1::divisor])
-        self.axe1.lines[line_number].set_xdata(
-                Experiment.data['data'][line_number][0][1::divisor])
+        Arguments:
+        buckets -- number of min/max buckets to reduce line to, defaults to
+            one per pixel of axes width
+        """
+        self.axe1.lines[line_number].set_data(
+            self._line_data(Experiment, line_number, buckets))
         # Format y-axis tick labels to be like `1.0nA`, `3.7mA`, etc.
 
     def changetype(self, Experiment):
@@ -162,6 +289,7 @@ class PlotBox(object):
         """
         self.axe1.set_xlabel(Experiment.xlabel)
         self.axe1.set_ylabel(Experiment.ylabel)
+        self.experiment = Experiment
         self.axe1.set_xlim(Experiment.xmin, Experiment.xmax)
 
         Experiment.plots['data'] = self
@@ -177,18 +305,51 @@ class PlotBox(object):
         return True
 
 class FT_Box(PlotBox):
-    def updateline(self, Experiment, line_number):
-        def search_value(data, target):
-            for i in range(len(data)):
-                if data[i] > target:
-                    return i
+    welch = None
 
+    def clearall(self):
+        """Remove all lines on plot and reset live spectrum."""
+        super(FT_Box, self).clearall()
+        self.welch = None
+
+    def update_live(self, Experiment, line_number=0):
+        """Update live spectrum of running experiment with Welch estimate.
+        Only segments completed since the last update are transformed.
+
+        Returns:
+        FT Integral around sync frequency, None if no segment is complete
+        """
+        x, y = Experiment.data['data'][line_number][:2]
+        fft_start = float(Experiment.parameters['fft_start'])
+        if not len(x) or x[-1] <= fft_start:
+            return None
+
+        if self.welch is None:
+            self.welch = WelchEstimator(
+                Experiment.parameters['adc_rate_hz'],
+                welch_segment(Experiment.parameters['adc_rate_hz'],
+                              float(Experiment.parameters['fft_int'])))
+
+        start = searchsorted(x, fft_start, side='right')
+        if not self.welch.update(y[start:]):
+            return None
+
+        f, Y = self.welch.spectrum()
+        self.axe1.lines[line_number].set_data(f, Y)
+        self.axe1.relim()
+        self.axe1.autoscale(True, axis='y')
+        self.canvas.draw_idle()
+
+        return integrateSpectrum(f, Y,
+                                 float(Experiment.parameters['sync_freq']),
+                                 float(Experiment.parameters['fft_int']))
+
+    def updateline(self, Experiment, line_number):
         y = Experiment.data['data'][line_number][1]
         x = Experiment.data['data'][line_number][0]
         freq = Experiment.parameters['adc_rate_hz']
         i = search_value(x, float(Experiment.parameters['fft_start']))
-        y1 = y[i:]
-        x1 = x[i:]
+        y1 = array(y[i:])  # copy, data is read-only
         avg = mean(y1)
         min_index, max_index = findBounds(y1)
         y1[min_index] = avg
@@ -210,6 +371,48 @@ class FT_Box(PlotBox):
 
         self.figure.canvas.draw()
 
+def static_figures(Experiment, resolution=1):
+    """Returns figures of an Experiment's data (and spectrum, if any) drawn
+    off-screen, independent of the GTK plots. Safe to build and save outside
+    the GTK main loop.
+
+    Arguments:
+    resolution -- decimation buckets per pixel of figure width
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    def new_figure():
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        figure.subplots_adjust(left=0.07, bottom=0.07, right=0.96, top=0.96)
+        axes = figure.add_subplot(111)
+        axes.ticklabel_format(style='sci', scilimits=(0, 3),
+                              useOffset=False, axis='y')
+        return figure, axes
+
+    figures = {}
+
+    figure, axes = new_figure()
+    buckets = max(int(figure.get_figwidth() * figure.dpi * resolution), 100)
+    for scan in Experiment.data['data']:
+        x, y = scan[0][1:], scan[1][1:]  # first sample is not plotted
+        axes.plot(*envelope(x, y, buckets))
+    axes.set_xlabel(Experiment.xlabel)
+    axes.set_ylabel(Experiment.ylabel)
+    axes.set_xlim(Experiment.xmin, Experiment.xmax)
+    figures['data'] = figure
+
+    if 'ft' in Experiment.data:
+        figure, axes = new_figure()
+        for f, Y in Experiment.data['ft']:
+            axes.plot(f, Y)
+        axes.set_xlabel("Freq (Hz)")
+        axes.set_ylabel("|Y| (A/Hz)")
+        axes.set_xlim(0, Experiment.parameters['adc_rate_hz']/2)
+        figures['ft'] = figure
+
+    return figures
+
 
 def plot_dstat_data(df_data, settling_period_s=2., axes=None, label=None):
     '''
@@ -106,6 +106,29 @@ class DstatPlugin(ZmqPlugin):
                                          metadata=data.get('metadata')
                                                  )
 
+    def on_execute__run_experiment_batch(self, request):
+        '''
+        Args
+        ----
+
+            params (list) : Parameters dictionaries in format returned by
+             `get_params`, one per experiment. Experiments are run
+             back-to-back in the order given.
+            metadata (dict) : Metadata used for all experiments in batch.
+
+        Returns
+        -------
+
+            (list) : UUIDs of experiments in batch.
+        '''
+        data = decode_content_data(request)
+        self.parent.statusbar.push(self.parent.message_context_id, "µDrop "
+                                   "batch acquisition requested.")
+        return self.parent.run_experiment_batch(
+                                         data['params'],
+                                         metadata=data.get('metadata')
+                                                )
+
     def on_execute__set_metadata(self, request=None):
         '''
         Args
@@ -135,8 +158,18 @@ class DstatPlugin(ZmqPlugin):
         data = decode_content_data(request)
         if data['experiment_id'] in self.parent.completed_experiment_ids:
             return self.parent.completed_experiment_data[data['experiment_id']]
-        elif data['experiment_id'] == self.parent.active_experiment_id:
+        elif (data['experiment_id'] == self.parent.active_experiment_id or
+              data['experiment_id'] in self.parent.queued_experiment_ids or
+              data['experiment_id'] in
+              self.parent.processing_experiment_ids):
             return None
+        elif data['experiment_id'] in self.parent.failed_experiment_ids:
+            raise RuntimeError(self.parent.failed_experiment_ids
+                               [data['experiment_id']])
+        elif data['experiment_id'] in self.parent.skipped_experiment_ids:
+            raise RuntimeError('Experiment %s was skipped because an earlier '
+                               'experiment in its batch failed.' %
+                               data['experiment_id'])
         else:
             raise KeyError('Unknown experiment ID: %s' % data['experiment_id'])
 
@@ -166,7 +199,17 @@ class DstatPlugin(ZmqPlugin):
                                    "notified of completed acquisition.")
         if data['experiment_id'] in self.parent.completed_experiment_ids:
             return self.parent.completed_experiment_ids[data['experiment_id']]
-        elif data['experiment_id'] == self.parent.active_experiment_id:
+        elif (data['experiment_id'] == self.parent.active_experiment_id or
+              data['experiment_id'] in self.parent.queued_experiment_ids or
+              data['experiment_id'] in
+              self.parent.processing_experiment_ids):
             return None
+        elif data['experiment_id'] in self.parent.failed_experiment_ids:
+            raise RuntimeError(self.parent.failed_experiment_ids
+                               [data['experiment_id']])
+        elif data['experiment_id'] in self.parent.skipped_experiment_ids:
+            raise RuntimeError('Experiment %s was skipped because an earlier '
+                               'experiment in its batch failed.' %
+                               data['experiment_id'])
         else:
             raise KeyError('Unknown experiment ID: %s' % data['experiment_id'])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Post-acquisition processing of experiments in a worker thread.
+"""
+import logging
+import Queue
+import sys
+import threading
+
+logger = logging.getLogger("dstat.postprocess")
+
+class PostProcessor(object):
+    """Runs jobs made of ordered stages in a worker thread. Jobs run one at a
+    time in the order submitted, so acquisition can continue while earlier
+    experiments are still being analysed and saved.
+    """
+    def __init__(self, run_in_main=None, notify=None):
+        """Starts worker thread.
+
+        Arguments:
+        run_in_main -- function that schedules a callable in the main (GUI)
+            thread, e.g. gobject.idle_add. Needed for stages wrapped with
+            in_main.
+        notify -- called in worker thread as notify(job, stage, index, total)
+            before each stage
+        """
+        self.run_in_main = run_in_main
+        self.notify = notify
+        self.queue = Queue.Queue()
+
+        self.thread = threading.Thread(target=self._run,
+                                       name="dstat-postprocess")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, job, stages, done=None):
+        """Queues a job.
+
+        Arguments:
+        job -- name of job used in notifications
+        stages -- list of (name, callable) run in order
+        done -- called as done(job, errors) after all stages have run, where
+            errors is a list of (stage, exception) for stages that failed
+        """
+        self.queue.put((job, stages, done))
+
+    @property
+    def pending(self):
+        """Number of jobs waiting or running."""
+        return self.queue.unfinished_tasks
+
+    def stop(self):
+        """Finishes queued jobs and stops worker thread. Don't call from the
+        main thread while jobs use in_main.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def in_main(self, function):
+        """Returns callable that runs function in the main thread and waits
+        for it to return. Exceptions are re-raised in the worker thread.
+        """
+        def wrapper():
+            finished = threading.Event()
+            result = {}
+
+            def call():
+                try:
+                    result['value'] = function()
+                except:
+                    result['error'] = sys.exc_info()
+                finally:
+                    finished.set()
+                return False  # Don't repeat if run from idle callback
+
+            self.run_in_main(call)
+            finished.wait()
+
+            if 'error' in result:
+                raise result['error'][0], result['error'][1], \
+                    result['error'][2]
+            return result.get('value')
+
+        return wrapper
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            job, stages, done = item
+            errors = []
+
+            for index, (stage, function) in enumerate(stages):
+                if self.notify is not None:
+                    self.notify(job, stage, index, len(stages))
+                try:
+                    function()
+                except Exception as err:
+                    logger.exception("%s: %s failed", job, stage)
+                    errors.append((stage, err))
+
+            if done is not None:
+                try:
+                    done(job, errors)
+                except Exception:
+                    logger.exception("%s: completion callback failed", job)
+            self.queue.task_done()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Columnar storage for experiment data.
+"""
+import numpy as np
+
+# Don't preallocate more than this many samples per scan from estimates
+MAX_PREALLOCATE = 2 ** 20
+# Capacity of scans without an estimate
+MIN_CAPACITY = 1024
+
+class ScanStore(object):
+    """Stores experiment data as one growable float64 array per column per
+    scan. Behaves like the list of tuples of lists it replaces: store[scan]
+    is a tuple of read-only array views, one per column.
+    """
+    def __init__(self, columns, expected_samples=0):
+        """Creates store with one empty scan.
+
+        Arguments:
+        columns -- number of data columns in each scan
+        expected_samples -- estimated samples per scan, used to preallocate
+            the first scan
+        """
+        self.columns = columns
+        self.capacity = int(min(max(expected_samples, MIN_CAPACITY),
+                                MAX_PREALLOCATE))
+        self._buffers = []
+        self._lengths = []
+        self.add_scan()
+
+    def add_scan(self):
+        """Appends an empty scan. The previous scan is trimmed to its length,
+        which is used as capacity of the new scan since scans of an
+        experiment are usually the same length.
+        """
+        if self._buffers:
+            length = self._lengths[-1]
+            self._buffers[-1] = self._buffers[-1][:, :length].copy()
+            if length:
+                self.capacity = max(length, MIN_CAPACITY)
+
+        self._buffers.append(np.empty((self.columns, self.capacity)))
+        self._lengths.append(0)
+
+    def extend(self, scan, columns):
+        """Appends samples to scan, adding scans as needed.
+
+        Arguments:
+        scan -- scan number
+        columns -- sequence of equal length arrays, one per column
+        """
+        while len(self._buffers) <= scan:
+            self.add_scan()
+
+        samples = len(columns[0])
+        length = self._lengths[scan]
+        buf = self._buffers[scan]
+
+        if length + samples > buf.shape[1]:
+            capacity = max(2 * buf.shape[1], length + samples)
+            grown = np.empty((self.columns, capacity))
+            grown[:, :length] = buf[:, :length]
+            self._buffers[scan] = buf = grown
+
+        for i, column in enumerate(columns):
+            buf[i, length:length + samples] = column
+        self._lengths[scan] = length + samples
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def __getitem__(self, scan):
+        if isinstance(scan, slice):
+            return [self[i] for i in range(len(self))[scan]]
+
+        length = self._lengths[scan]
+        view = self._buffers[scan][:, :length]
+        view.flags.writeable = False
+        return tuple(view)
+
+    def __iter__(self):
+        for scan in range(len(self)):
+            yield self[scan]
+
+    def samples(self, scan):
+        """Returns number of samples in scan."""
+        return self._lengths[scan]
+
+    def arrays(self):
+        """Returns list of tuples of column arrays (copies)."""
+        return [tuple(np.array(column) for column in scan) for scan in self]
+
+    def tolist(self):
+        """Returns data as list of tuples of lists of floats."""
+        return [tuple(column.tolist() for column in scan) for scan in self]
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for data."""
+        return sum(buf.nbytes for buf in self._buffers)
+
+    def __getstate__(self):
+        """Drops unused capacity when pickled."""
+        state = self.__dict__.copy()
+        state['_buffers'] = [buf[:, :length].copy() for buf, length in
+                             zip(self._buffers, self._lengths)]
+        return state
+
+    def __setstate__(self, state):
+        """Restores capacity of the last scan, which may still be extended."""
+        self.__dict__.update(state)
+        length = self._lengths[-1]
+        if length < self.capacity:
+            buf = np.empty((self.columns, self.capacity))
+            buf[:, :length] = self._buffers[-1]
+            self._buffers[-1] = buf
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Checks that decoding blocks of sample records with batch_data_handler gives
+the same values as decoding each record with data_handler.
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+# Modules import each other by name from the package directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dstat_comm as comm
+
+SETTINGS = {name: [i, str(trim)] for i, (name, trim) in enumerate(
+    [('r100_trim', -7), ('r3k_trim', 12), ('r30k_trim', -250),
+     ('r300k_trim', 31), ('r3M_trim', 0), ('r30M_trim', 4),
+     ('r100M_trim', -1)])}
+
+COMMON = {'version': (1, 2), 'gain': '3', 'buffer_true': True,
+          'adc_rate': '60', 'adc_pga': '2', 'short_true': False}
+
+SWEEP = {'clean_s': 0, 'dep_s': 0, 'clean_mV': 0, 'dep_mV': 0}
+
+PARAMETERS = {
+    comm.Chronoamp: {'potential': [100, -200], 'time': [2, 3]},
+    comm.PDExp: {'time': 5, 'voltage': 300, 'shutter_true': False,
+                 'sync_true': False, 'interlock_true': False},
+    comm.PotExp: {'time': 5},
+    comm.LSVExp: dict(SWEEP, start=-500, stop=500, slope=100),
+    comm.CVExp: dict(SWEEP, v1=-500, v2=500, start=0, scans=2, slope=100),
+    comm.SWVExp: dict(SWEEP, start=-500, stop=500, step=2, pulse=25,
+                      freq=30, scans=1),
+    comm.DPVExp: dict(SWEEP, start=-500, stop=500, step=2, pulse=25,
+                      period=100, width=50),
+}
+
+
+def records(dtype, count=200, seed=0):
+    """Returns count random records of dtype as raw bytes, starting with
+    the extreme values of each field.
+    """
+    rng = np.random.RandomState(seed)
+    array = np.zeros(count, dtype=dtype)
+    for name in dtype.names:
+        info = np.iinfo(dtype[name])
+        array[name] = rng.randint(info.min, int(info.max) + 1, count,
+                                  dtype=np.int64)
+        array[name][:2] = info.min, info.max
+    return array.tostring()
+
+
+class TestBatchDataHandler(unittest.TestCase):
+    def assertDecodesEqual(self, experiment, scalar, batch):
+        """Decodes the same raw records with both handlers. scalar and
+        batch take the raw bytes of one record or of all records and return
+        a sequence of columns.
+        """
+        data = records(experiment.record_dtype)
+        size = experiment.record_dtype.itemsize
+        rows = [scalar(data[i:i + size]) for i in range(0, len(data), size)]
+        expected = np.array(rows, dtype=float).reshape(len(rows), -1).T
+        result = np.array(batch(data), dtype=float).reshape(len(expected), -1)
+        np.testing.assert_array_equal(result, expected)
+
+    def assertHandlersEqual(self, experiment, scan=3):
+        def scalar(data):
+            result_scan, columns = experiment.data_handler((scan, data))
+            self.assertEqual(result_scan, scan)
+            return columns
+
+        def batch(data):
+            result_scan, columns = experiment.batch_data_handler((scan, data))
+            self.assertEqual(result_scan, scan)
+            return columns
+
+        self.assertDecodesEqual(experiment, scalar, batch)
+
+    def test_experiments(self):
+        for experiment_class, parameters in PARAMETERS.iteritems():
+            experiment = experiment_class(dict(COMMON, **parameters),
+                                          settings=SETTINGS)
+            self.assertHandlersEqual(experiment)
+
+    def test_record_dtypes(self):
+        """Every record layout is covered by test_experiments."""
+        dtypes = set(','.join(i.record_dtype[name].str
+                              for name in i.record_dtype.names)
+                     for i in PARAMETERS)
+        self.assertEqual(dtypes,
+                         set(['<u2,<i4', '<u2,<u2,<i4', '<u2,<i4,<i4']))
+
+    def test_calibration(self):
+        experiment = comm.CALExp({'gain': 3, 'time': 5})
+        self.assertDecodesEqual(experiment, experiment.data_handler,
+                                experiment.batch_data_handler)
+
+    def test_ocp(self):
+        experiment = comm.OCPExp()
+        self.assertDecodesEqual(
+            experiment, lambda data: experiment.data_handler((0, data)),
+            lambda data: experiment.batch_data_handler((0, data)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#     DStat Interface - An interface for the open hardware DStat potentiostat
+#     Copyright (C) 2014  Michael D. M. Dryden -
+#     Wheeler Microfluidics Laboratory <http://microfluidics.utoronto.ca>
+#
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compares text export with a file written by an earlier version.
+"""
+import datetime as dt
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Modules import each other by name from the package directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+from interface import save
+from scan_store import ScanStore
+
+# Lines added to the analysis header since the baseline file was written
+EXTRA_LINES = ["#  std:\n",
+               "#    Scan 0 -- 0.00160030978506\n",
+               "#    Scan 1 -- 0.00149613368986\n",
+               "#  median:\n",
+               "#    Scan 0 -- 0.0\n",
+               "#    Scan 1 -- -0.00066779\n",
+               "#  5th percentile:\n",
+               "#    Scan 0 -- -0.00218166\n",
+               "#    Scan 1 -- -0.00218166\n",
+               "#  95th percentile:\n",
+               "#    Scan 0 -- 0.00218166\n",
+               "#    Scan 1 -- 0.00211983\n"]
+
+
+class Experiment(object):
+    """Minimal CV experiment with two scans."""
+    def __init__(self):
+        self.time = dt.datetime(2017, 3, 14, 15, 9, 26)
+        self.commands = ["EA2 3 1 ", "EG2 0 ", "C0 0 -500 500 2 100 "]
+        self.parameters = {'stats_true': True,
+                           'stats_start_true': False, 'stats_start': 0,
+                           'stats_stop_true': False, 'stats_stop': 0}
+
+        self.data = {'data': ScanStore(2)}
+        for scan in range(2):
+            voltage = np.arange(-500, 501, 5) / 1000.
+            current = np.round(np.sin(voltage * 10 + scan) * 2.2e-3, 8)
+            self.data['data'].extend(scan, (voltage, current))
+        self.analysis = {}
+
+
+class TestSaveText(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self):
+        experiment = Experiment()
+        analysis.do_analysis(experiment)
+        save.save_text(experiment, os.path.join(self.directory, 'cv.txt'))
+        with open(os.path.join(self.directory, 'cv-data.txt')) as output:
+            return output.readlines()
+
+    def test_baseline(self):
+        """Output matches earlier versions apart from the added statistics,
+        which follow the other analysis results.
+        """
+        with open(os.path.join(DATA_DIR, 'cv-data.txt')) as baseline:
+            expected = baseline.readlines()
+        header_end = max(i for i, line in enumerate(expected)
+                         if line.startswith('#')) + 1
+        expected[header_end:header_end] = EXTRA_LINES
+
+        self.assertEqual(self.export(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()